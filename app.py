@@ -1,4 +1,6 @@
+import startup  # first, so the import timing covers the rest of the app
 import os
+import time
 import logging
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
@@ -22,7 +24,10 @@ db = SQLAlchemy(model_class=Base)
 # Create the app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+# X-Forwarded-For is only trusted from this many proxies in front of the app
+# (1 behind Railway's edge). With 0, clients can't pick their own IP for rate limiting.
+trusted_proxy_hops = int(os.environ.get('TRUSTED_PROXY_HOPS', 0))
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxy_hops, x_proto=1, x_host=1)
 
 # Configure the database
 database_url = os.environ.get("DATABASE_URL")
@@ -44,9 +49,14 @@ with app.app_context():
     # Import models and routes
     import models  # noqa: F401
     import routes  # noqa: F401
-    
-    # Create all database tables
-    db.create_all()
+
+startup.record('import_seconds', time.monotonic() - startup.STARTED)
+
+# Create all database tables and add columns/indexes missing from older tables.
+# With SCHEMA_SETUP_ON_BOOT=0 this runs after the first request instead (or
+# ahead of time via migrate.py), keeping it off the path to a healthy worker.
+if os.environ.get('SCHEMA_SETUP_ON_BOOT', '1') != '0':
+    startup.init_database(app)
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,523 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the download pipeline
+
+Serves synthetic media from a local HTTP server, resolves bench video IDs to
+it through yt-dlp's generic extractor, and drives the real app (queue,
+workers, planner, tuner, transcoder, file serving) over HTTP. Nothing talks
+to YouTube, so results are comparable between commits:
+
+    python benchmark.py --output bench/$(git rev-parse --short HEAD).json
+    python benchmark.py --compare bench/old.json --output bench/new.json
+
+Runs in a temporary directory with its own SQLite database and downloads
+folder; the working tree is never touched.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import urllib.request
+from urllib.error import HTTPError
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('benchmark')
+
+MB = 1048576
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class MediaHandler(SimpleHTTPRequestHandler):
+    """Static files with single Range support, optional first-byte delay and rate cap"""
+
+    latency = 0.0        # seconds before the first byte
+    rate_limit = 0       # bytes per second per connection, 0 = unlimited
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        range_header = self.headers.get('Range', '')
+        if range_header.startswith('bytes='):
+            first, _, last = range_header[6:].split(',')[0].partition('-')
+            if first:
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+            elif last:
+                start = max(0, size - int(last))
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.end_headers()
+                return None
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        f = open(path, 'rb')
+        f.seek(start)
+        self._remaining = end - start + 1
+        return f
+
+    def copyfile(self, source, outputfile):
+        if self.latency:
+            time.sleep(self.latency)
+        block = 65536
+        started = time.monotonic()
+        sent = 0
+        while self._remaining > 0:
+            data = source.read(min(block, self._remaining))
+            if not data:
+                break
+            try:
+                outputfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            sent += len(data)
+            self._remaining -= len(data)
+            if self.rate_limit:
+                ahead = sent / self.rate_limit - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_media_server(directory, latency, rate_limit):
+    handler = type('BenchMediaHandler', (MediaHandler,), {'latency': latency, 'rate_limit': rate_limit})
+    server = ThreadingHTTPServer(('127.0.0.1', free_port()),
+                                 lambda *args, **kwargs: handler(*args, directory=directory, **kwargs))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+def make_media(directory, size_mb, duration):
+    """Write media.mp4 (and media.m4a); real encodes when ffmpeg exists, random bytes otherwise"""
+    video_path = os.path.join(directory, 'media.mp4')
+    audio_path = os.path.join(directory, 'media.m4a')
+    if shutil.which('ffmpeg'):
+        # Noise keeps the encoder from compressing the file below the requested size
+        bitrate = int(size_mb * MB * 8 / duration / 1000)
+        subprocess.run([
+            'ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+            '-f', 'lavfi', '-i', f'nullsrc=s=640x360:d={duration},geq=random(1)*255:128:128',
+            '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-b:v', f'{bitrate}k',
+            '-c:a', 'aac', '-b:a', '128k', '-shortest', video_path
+        ], check=True)
+        subprocess.run([
+            'ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+            '-i', video_path, '-vn', '-acodec', 'copy', audio_path
+        ], check=True)
+        return True
+    for path, size in ((video_path, int(size_mb * MB)), (audio_path, int(duration * 16000))):
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+    return False
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(pct / 100.0 * (len(values) - 1)))))
+    return values[index]
+
+def summarize(samples):
+    """Latency summary in milliseconds"""
+    return {
+        'count': len(samples),
+        'mean_ms': round(sum(samples) / len(samples) * 1000, 2) if samples else None,
+        'p50_ms': round(percentile(samples, 50) * 1000, 2) if samples else None,
+        'p95_ms': round(percentile(samples, 95) * 1000, 2) if samples else None,
+        'max_ms': round(max(samples) * 1000, 2) if samples else None
+    }
+
+def fetch(url, data=None, read=True):
+    """(status, seconds to first byte, total seconds, body bytes or length)"""
+    headers = {'Content-Type': 'application/json'} if data is not None else {}
+    body = json.dumps(data).encode() if data is not None else None
+    request = urllib.request.Request(url, data=body, headers=headers)
+    started = time.perf_counter()
+    try:
+        response = urllib.request.urlopen(request, timeout=600)
+    except HTTPError as e:
+        response = e
+    with response:
+        first = response.read(1)
+        ttfb = time.perf_counter() - started
+        if read:
+            content = first + response.read()
+        else:
+            content = len(first)
+            while True:
+                chunk = response.read(65536)
+                if not chunk:
+                    break
+                content += len(chunk)
+        return response.status, ttfb, time.perf_counter() - started, content
+
+class VideoIds:
+    """Unique 11-character IDs so every benchmark download is a fresh job"""
+
+    def __init__(self):
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def new(self):
+        with self._lock:
+            self._next += 1
+            return f'bench{self._next:06d}'
+
+class Benchmark:
+    def __init__(self, args, workdir):
+        self.args = args
+        self.workdir = workdir
+        self.ids = VideoIds()
+        self.results = {}
+
+    def setup(self):
+        media_dir = os.path.join(self.workdir, 'media')
+        os.makedirs(media_dir)
+        self.real_media = make_media(media_dir, self.args.size_mb, self.args.duration)
+        self.media_path = os.path.join(media_dir, 'media.mp4')
+        self.media_server, media_url = start_media_server(
+            media_dir, self.args.latency_ms / 1000.0, int(self.args.link_mbps * MB / 8))
+
+        # The app reads its configuration at import time
+        os.environ.update({
+            'DATABASE_URL': f"sqlite:///{os.path.join(self.workdir, 'bench.db')}",
+            'MAX_CONCURRENT_DOWNLOADS': str(max(self.args.concurrency)),
+            'JOB_POLL_INTERVAL': '0.2',
+            'RATE_LIMIT_ENABLED': '0',
+            'MAX_QUEUE_DEPTH': '100000'
+        })
+        os.chdir(self.workdir)
+        sys.path.insert(0, REPO_DIR)
+
+        import_started = time.perf_counter()
+        import yt_dlp
+        import downloader
+        from app import app
+        self.results['import_seconds'] = round(time.perf_counter() - import_started, 3)
+
+        # Resolve the stand-in media once with the generic extractor, then hand
+        # out copies carrying the requested video ID and codec details
+        with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}) as ydl:
+            video = ydl.extract_info(f'{media_url}/media.mp4', download=False)
+            audio = ydl.extract_info(f'{media_url}/media.m4a', download=False)
+        video_format = dict(video['formats'][0], format_id='18', vcodec='avc1.42001E', acodec='mp4a.40.2',
+                            height=360, width=640, filesize=os.path.getsize(self.media_path))
+        audio_format = dict(audio['formats'][0], format_id='140', vcodec='none', acodec='mp4a.40.2', abr=128,
+                            filesize=os.path.getsize(os.path.join(media_dir, 'media.m4a')))
+        template = dict(video, formats=[audio_format, video_format], duration=self.args.duration)
+        for key in ('url', 'format_id', 'ext', 'requested_formats', 'requested_downloads'):
+            template.pop(key, None)
+
+        def extract_raw_info(downloader_self, url):
+            video_id = downloader.extract_video_id(url) or 'bench000000'
+            info = json.loads(json.dumps(template))
+            info.update({'id': video_id, 'title': f'Benchmark {video_id}', 'webpage_url': url})
+            return info
+
+        downloader.YouTubeDownloader._extract_raw_info = extract_raw_info
+
+        original_init = downloader.YouTubeDownloader.__init__
+
+        def init_for_bench(downloader_self, *init_args, **init_kwargs):
+            original_init(downloader_self, *init_args, **init_kwargs)
+            downloader_self.base_ydl_opts.update({'quiet': True, 'noprogress': True})
+            if not self.args.sleep:
+                # The randomised pause between requests is there for YouTube; here it only adds noise
+                for key in ('sleep_interval', 'max_sleep_interval'):
+                    downloader_self.base_ydl_opts.pop(key, None)
+
+        downloader.YouTubeDownloader.__init__ = init_for_bench
+
+        # send_file resolves relative download paths against the app root, which
+        # is the working directory in a normal deployment
+        app.root_path = self.workdir
+
+        from werkzeug.serving import make_server
+        self.app_server = make_server('127.0.0.1', free_port(), app, threaded=True)
+        threading.Thread(target=self.app_server.serve_forever, daemon=True).start()
+        self.base_url = f'http://127.0.0.1:{self.app_server.server_port}'
+        fetch(f'{self.base_url}/health')  # starts the embedded workers
+
+    def teardown(self):
+        for server in (getattr(self, 'app_server', None), getattr(self, 'media_server', None)):
+            if server:
+                server.shutdown()
+
+    def video_url(self, video_id):
+        return f'https://youtu.be/{video_id}'
+
+    def run_job(self):
+        """Queue one download through the API and wait for it to finish"""
+        video_id = self.ids.new()
+        started = time.perf_counter()
+        _, _, _, body = fetch(f'{self.base_url}/api/download',
+                              {'url': self.video_url(video_id), 'format': 'video', 'quality': '360p'})
+        download_id = json.loads(body)['download_id']
+        while True:
+            _, _, _, body = fetch(f'{self.base_url}/api/download/{download_id}/status')
+            status = json.loads(body)
+            if status['status'] in ('completed', 'failed'):
+                break
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - started
+        size = 0
+        if status['status'] == 'completed' and status.get('file_path') and os.path.exists(status['file_path']):
+            size = os.path.getsize(status['file_path'])
+        return status['status'] == 'completed', elapsed, size, download_id
+
+    def bench_end_to_end(self, concurrency):
+        """Submit-to-completed jobs through the queue, workers and disk"""
+        jobs = self.args.jobs * concurrency
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(lambda _: self.run_job(), range(jobs)))
+        wall = time.perf_counter() - started
+        completed = [o for o in outcomes if o[0]]
+        total_bytes = sum(o[2] for o in completed)
+        self.completed_id = completed[-1][3] if completed else None
+        return {
+            'jobs': jobs,
+            'failed': jobs - len(completed),
+            'wall_seconds': round(wall, 3),
+            'jobs_per_second': round(len(completed) / wall, 3),
+            'throughput_mbps': round(total_bytes * 8 / MB / wall, 2),
+            'job_latency': summarize([o[1] for o in completed])
+        }
+
+    def bench_ttfb(self, concurrency):
+        """First byte of a live stream (fetch + relay) and of a finished file"""
+        def stream_once(_):
+            url = f'{self.base_url}/api/get/stream?url={self.video_url(self.ids.new())}&format=video&quality=360p&save=0'
+            status, ttfb, total, size = fetch(url, read=False)
+            return status == 200, ttfb, total, size
+
+        def file_once(_):
+            status, ttfb, total, size = fetch(f'{self.base_url}/api/download/{self.completed_id}/file', read=False)
+            return status == 200, ttfb, total, size
+
+        result = {}
+        for name, fn in (('stream', stream_once), ('file', file_once)):
+            if name == 'file' and not self.completed_id:
+                continue
+            requests = self.args.jobs * concurrency
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                outcomes = list(pool.map(fn, range(requests)))
+            wall = time.perf_counter() - started
+            ok = [o for o in outcomes if o[0]]
+            result[name] = {
+                'requests': requests,
+                'failed': requests - len(ok),
+                'ttfb': summarize([o[1] for o in ok]),
+                'throughput_mbps': round(sum(o[3] for o in ok) * 8 / MB / wall, 2)
+            }
+        return result
+
+    def bench_transcode(self, concurrency):
+        """mp3 encodes of the media file through the transcode scheduler"""
+        from transcoder import transcoder
+        out_dir = os.path.join(self.workdir, 'transcode')
+        os.makedirs(out_dir, exist_ok=True)
+
+        def encode(i):
+            output = os.path.join(out_dir, f'{concurrency}_{i}.mp3')
+            started = time.perf_counter()
+            try:
+                transcoder.run(transcoder.audio_cmd(self.media_path, output, '192'))
+                return True, time.perf_counter() - started
+            except Exception as e:
+                logger.error(f"Transcode failed: {str(e)}")
+                return False, time.perf_counter() - started
+            finally:
+                if os.path.exists(output):
+                    os.remove(output)
+
+        jobs = self.args.jobs * concurrency
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(encode, range(jobs)))
+        wall = time.perf_counter() - started
+        ok = [o[1] for o in outcomes if o[0]]
+        return {
+            'jobs': jobs,
+            'failed': jobs - len(ok),
+            'pool_workers': transcoder.max_workers,
+            'wall_seconds': round(wall, 3),
+            'realtime_factor': round(len(ok) * self.args.duration / wall, 2),
+            'job_latency': summarize(ok)
+        }
+
+    def bench_api(self, concurrency):
+        """Latency of the cheap endpoints the UI and clients poll"""
+        warm_id = self.ids.new()
+        fetch(f'{self.base_url}/api/get/info?url={self.video_url(warm_id)}')
+        endpoints = {
+            'health': '/health',
+            'stats': '/api/stats',
+            'history': '/api/history?limit=20',
+            'info_cached': f'/api/get/info?url={self.video_url(warm_id)}',
+            'metrics': '/metrics'
+        }
+        if self.completed_id:
+            endpoints['status'] = f'/api/download/{self.completed_id}/status'
+
+        result = {}
+        for name, path in endpoints.items():
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                outcomes = list(pool.map(lambda _: fetch(self.base_url + path), range(self.args.requests)))
+            ok = [o[2] for o in outcomes if o[0] == 200]
+            result[name] = dict(summarize(ok), failed=len(outcomes) - len(ok))
+        return result
+
+    def run(self):
+        scenarios = [s for s in self.args.scenarios if s != 'transcode' or self.real_media]
+        if 'transcode' in self.args.scenarios and not self.real_media:
+            logger.warning("ffmpeg not found; skipping transcode benchmark")
+            self.results['transcode'] = {'skipped': 'ffmpeg not found'}
+
+        self.completed_id = None
+        # ttfb and api reuse a finished download, so end-to-end runs first
+        for scenario in ('end_to_end', 'ttfb', 'transcode', 'api'):
+            if scenario not in scenarios:
+                continue
+            fn = getattr(self, f'bench_{scenario}')
+            self.results[scenario] = {}
+            for concurrency in self.args.concurrency:
+                logger.info(f"Running {scenario} at concurrency {concurrency}...")
+                self.results[scenario][str(concurrency)] = fn(concurrency)
+        return self.results
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except Exception:
+        return None
+
+def flatten(data, prefix=''):
+    for key, value in data.items():
+        path = f'{prefix}.{key}' if prefix else key
+        if isinstance(value, dict):
+            yield from flatten(value, path)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield path, value
+
+def compare(previous, current):
+    """Print the relative change of every numeric result present in both runs"""
+    old = dict(flatten(previous.get('results', {})))
+    print(f"\nChange from {previous.get('revision') or 'previous run'} to {current.get('revision') or 'this run'}:")
+    for path, value in flatten(current['results']):
+        if path in old and old[path]:
+            change = (value - old[path]) / old[path] * 100
+            print(f"  {path:<60} {old[path]:>12} -> {value:>12} ({change:+.1f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark against a local stand-in media server')
+    parser.add_argument('--concurrency', default='1,4,8',
+                        help='comma-separated concurrency levels (default: 1,4,8)')
+    parser.add_argument('--jobs', type=int, default=2,
+                        help='downloads/streams/encodes per concurrent client (default: 2)')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per API endpoint and level (default: 200)')
+    parser.add_argument('--size-mb', type=float, default=4, help='synthetic media size in MB (default: 4)')
+    parser.add_argument('--duration', type=int, default=30, help='synthetic media length in seconds (default: 30)')
+    parser.add_argument('--latency-ms', type=float, default=0, help='media server delay before the first byte')
+    parser.add_argument('--link-mbps', type=float, default=0,
+                        help='media server rate cap per connection in Mbit/s (default: unlimited)')
+    parser.add_argument('--scenarios', default='end_to_end,ttfb,transcode,api',
+                        help='comma-separated subset of end_to_end,ttfb,transcode,api')
+    parser.add_argument('--sleep', action='store_true',
+                        help="keep yt-dlp's randomised sleep between downloads (off by default)")
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='earlier results JSON to diff against')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary working directory')
+    args = parser.parse_args()
+    args.concurrency = [int(c) for c in args.concurrency.split(',') if c.strip()]
+    args.scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    output_path = os.path.abspath(args.output) if args.output else None
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix='ytdl-bench-')
+
+    bench = Benchmark(args, workdir)
+    try:
+        bench.setup()
+        # Keep the app's own request and job logging out of the timings
+        logging.getLogger().setLevel(logging.ERROR)
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        logger.setLevel(logging.INFO)
+        results = bench.run()
+    finally:
+        bench.teardown()
+        os.chdir(cwd)
+        if args.keep:
+            logger.info(f"Working directory kept at {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'ffmpeg': bool(shutil.which('ffmpeg'))
+        },
+        'config': {
+            'concurrency': args.concurrency,
+            'jobs': args.jobs,
+            'requests': args.requests,
+            'size_mb': args.size_mb,
+            'duration': args.duration,
+            'latency_ms': args.latency_ms,
+            'link_mbps': args.link_mbps,
+            'sleep': args.sleep,
+            'scenarios': args.scenarios
+        },
+        'results': results
+    }
+
+    text = json.dumps(report, indent=2)
+    if output_path:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, 'w') as f:
+            f.write(text + '\n')
+        logger.info(f"Results written to {output_path}")
+    else:
+        print(text)
+
+    if compare_path:
+        with open(compare_path) as f:
+            compare(json.load(f), report)
+
+if __name__ == "__main__":
+    main()
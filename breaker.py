@@ -0,0 +1,139 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Failures that say something about the method rather than the video
+BREAKER_ERROR_CLASSES = ('forbidden', 'sign_in_required', 'timeout', 'network', 'other')
+
+class MethodBreaker:
+    """Outcome statistics, circuit breakers and ordering for fallback methods
+
+    Methods are identified by operation ('extract', 'video_download', ...)
+    and their position in the caller's list. After failure_threshold
+    consecutive failures a method's circuit opens and it is skipped for
+    cooldown seconds. Methods that are not skipped are tried in order of
+    their recent success rate, so whichever currently works goes first. A
+    method whose last failure is cooldown seconds old is probed first by a
+    single request, so a recovered method wins back its place: success
+    closes its circuit, failure reopens it. If every circuit is open, the
+    one closest to reopening is still tried rather than failing outright.
+    """
+
+    def __init__(self, failure_threshold=3, cooldown=300, window=20, enabled=True):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.cooldown = float(cooldown)
+        self.window = int(window)
+        self.enabled = enabled
+        self._methods = {}  # (operation, index) -> state dict
+        self._lock = threading.Lock()
+
+    def _state(self, operation, index):
+        # Caller must hold self._lock
+        key = (operation, index)
+        if key not in self._methods:
+            self._methods[key] = {
+                'outcomes': deque(maxlen=self.window),
+                'consecutive_failures': 0,
+                'open_until': 0.0,
+                'last_failure': 0.0,
+                'probe_started': 0.0,
+                'times_opened': 0,
+                'mean_seconds': None,
+                'last_error': None
+            }
+        return self._methods[key]
+
+    @staticmethod
+    def _success_rate(state):
+        # Smoothed so an untried method scores 0.5 instead of 0 or 1
+        outcomes = state['outcomes']
+        return (sum(outcomes) + 1) / (len(outcomes) + 2)
+
+    def order(self, operation, methods):
+        """(index, method) pairs in the order they should be tried"""
+        if not self.enabled:
+            return list(enumerate(methods))
+
+        now = time.monotonic()
+        probes, available, skipped = [], [], []
+        with self._lock:
+            for index in range(len(methods)):
+                state = self._state(operation, index)
+                stale = state['last_failure'] <= now - self.cooldown
+                probing = state['probe_started'] > now - self.cooldown
+                if state['consecutive_failures'] and stale and not probing:
+                    # Failed a while ago: give it one request to show it works again
+                    state['probe_started'] = now
+                    probes.append(index)
+                elif state['open_until']:
+                    # Cooling down, or another request is already probing it
+                    skipped.append((state['open_until'], index))
+                else:
+                    available.append((self._success_rate(state), index))
+
+        available.sort(key=lambda item: (-item[0], item[1]))
+        ordered = probes + [index for _, index in available]
+        if not ordered:
+            ordered = [min(skipped)[1]]
+        if skipped and len(ordered) < len(methods):
+            logger.info(f"Skipping {operation} methods with open circuits: "
+                        f"{', '.join(str(index + 1) for _, index in sorted(skipped) if index not in ordered)}")
+        return [(index, methods[index]) for index in ordered]
+
+    def record(self, operation, index, success, elapsed=None, error_class=None):
+        """Record an attempt; failures outside BREAKER_ERROR_CLASSES are ignored"""
+        with self._lock:
+            state = self._state(operation, index)
+            # Any answer ends a probe. A failure that says nothing about the method
+            # (private video, postprocessing) leaves it due for the next request.
+            state['probe_started'] = 0.0
+            if not success and error_class not in BREAKER_ERROR_CLASSES:
+                return
+
+            state['outcomes'].append(1 if success else 0)
+            if elapsed is not None:
+                previous = state['mean_seconds']
+                state['mean_seconds'] = elapsed if previous is None else previous * 0.8 + elapsed * 0.2
+
+            if success:
+                if state['open_until']:
+                    logger.info(f"Closing circuit for {operation} method {index + 1}")
+                state['consecutive_failures'] = 0
+                state['open_until'] = 0.0
+                return
+
+            state['consecutive_failures'] += 1
+            state['last_error'] = error_class
+            state['last_failure'] = time.monotonic()
+            if state['open_until'] or state['consecutive_failures'] >= self.failure_threshold:
+                state['open_until'] = state['last_failure'] + self.cooldown
+                state['times_opened'] += 1
+                logger.warning(f"Opening circuit for {operation} method {index + 1} for {self.cooldown:.0f}s "
+                               f"after {state['consecutive_failures']} consecutive failures ({error_class})")
+
+    def stats(self):
+        now = time.monotonic()
+        result = {}
+        with self._lock:
+            for (operation, index), state in sorted(self._methods.items()):
+                result.setdefault(operation, {})[str(index + 1)] = {
+                    'state': 'closed' if not state['open_until'] else ('open' if state['open_until'] > now else 'half_open'),
+                    'attempts': len(state['outcomes']),
+                    'success_rate': round(sum(state['outcomes']) / len(state['outcomes']), 3) if state['outcomes'] else None,
+                    'consecutive_failures': state['consecutive_failures'],
+                    'reopens_in': round(state['open_until'] - now, 1) if state['open_until'] > now else None,
+                    'times_opened': state['times_opened'],
+                    'mean_seconds': round(state['mean_seconds'], 3) if state['mean_seconds'] is not None else None,
+                    'last_error': state['last_error']
+                }
+        return result
+
+method_breaker = MethodBreaker(
+    failure_threshold=os.environ.get('METHOD_BREAKER_THRESHOLD', 3),
+    cooldown=os.environ.get('METHOD_BREAKER_COOLDOWN', 300),
+    enabled=os.environ.get('METHOD_BREAKER_ENABLED', '1') != '0'
+)
@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+class MetadataCache:
+    """Bounded TTL/LRU cache for video metadata keyed by YouTube video ID"""
+
+    def __init__(self, max_entries=512, ttl_seconds=3600, persistent=False):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = float(ttl_seconds)
+        self.persistent = persistent
+        self._entries = OrderedDict()  # video_id -> (expires_at, info)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.persistent_hits = 0
+        self.evictions = 0
+
+    def get(self, video_id):
+        """Return a copy of the cached info, or None on a miss"""
+        if not video_id:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry:
+                expires_at, info = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(video_id)
+                    self.hits += 1
+                    return dict(info)
+                del self._entries[video_id]
+
+        info = self._load_persistent(video_id) if self.persistent else None
+        with self._lock:
+            if info is None:
+                self.misses += 1
+                return None
+            self.persistent_hits += 1
+            self._store(video_id, info)
+            return dict(info)
+
+    def contains(self, video_id):
+        """True if video_id is cached in memory; unlike get() it touches neither stats nor LRU order"""
+        with self._lock:
+            entry = self._entries.get(video_id)
+            return entry is not None and entry[0] > time.monotonic()
+
+    def set(self, video_id, info):
+        if not video_id or not info:
+            return
+        with self._lock:
+            self._store(video_id, dict(info))
+        if self.persistent:
+            self._save_persistent(video_id, info)
+
+    def invalidate(self, video_id):
+        with self._lock:
+            self._entries.pop(video_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.persistent_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'persistent_hits': self.persistent_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round((self.hits + self.persistent_hits) / lookups, 3) if lookups else 0.0
+            }
+
+    def _store(self, video_id, info):
+        # Caller must hold self._lock
+        self._entries[video_id] = (time.monotonic() + self.ttl_seconds, info)
+        self._entries.move_to_end(video_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _load_persistent(self, video_id):
+        from flask import has_app_context
+        if not has_app_context():
+            return None
+        try:
+            from models import VideoInfoCache
+            row = VideoInfoCache.query.get(video_id)
+            if not row:
+                return None
+            if row.fetched_at < datetime.utcnow() - timedelta(seconds=self.ttl_seconds):
+                return None
+            return json.loads(row.info)
+        except Exception as e:
+            logger.warning(f"Metadata cache lookup failed for {video_id}: {str(e)}")
+            return None
+
+    def _save_persistent(self, video_id, info):
+        from flask import has_app_context
+        if not has_app_context():
+            return
+        from app import db
+        from models import VideoInfoCache
+        try:
+            db.session.merge(VideoInfoCache(
+                video_id=video_id,
+                info=json.dumps(info),
+                fetched_at=datetime.utcnow()
+            ))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"Metadata cache write failed for {video_id}: {str(e)}")
+
+metadata_cache = MetadataCache(
+    max_entries=os.environ.get('METADATA_CACHE_SIZE', 512),
+    ttl_seconds=os.environ.get('METADATA_CACHE_TTL', 3600),
+    persistent=os.environ.get('METADATA_CACHE_PERSIST', '').lower() in ('1', 'true', 'yes')
+)
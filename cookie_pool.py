@@ -0,0 +1,174 @@
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Error classes (see metrics.classify_error) that mean YouTube is pushing back on an identity
+THROTTLE_ERROR_CLASSES = ('forbidden', 'sign_in_required')
+
+class CookieJarEntry:
+    """One cookie identity: a parsed jar plus its throttling history"""
+
+    def __init__(self, path, cookies, mtime, size):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.cookies = cookies
+        self.mtime = mtime
+        self.size = size
+        self.cooldown_until = 0.0
+        self.last_throttled = 0.0
+        self.uses = 0
+        self.throttles = 0
+
+    def stats(self, now):
+        return {
+            'name': self.name,
+            'cookies': len(self.cookies),
+            'bytes': self.size,
+            'uses': self.uses,
+            'throttles': self.throttles,
+            'cooling_down_for': round(self.cooldown_until - now, 1) if self.cooldown_until > now else None
+        }
+
+def load_cookie_file(path):
+    """Parse a Netscape cookies.txt into a yt-dlp cookie jar (raises if it isn't one)"""
+    from yt_dlp.cookies import YoutubeDLCookieJar
+    jar = YoutubeDLCookieJar(path)
+    jar.load()
+    return jar
+
+class CookiePool:
+    """Cookie identities loaded once per process and shared between requests
+
+    Every .txt file in directory (plus the legacy cookies.txt, if present)
+    is one identity. Files are parsed once and reparsed only when they
+    change; the directory is rescanned at most every rescan_seconds. Each
+    downloader acquires one jar, either round-robin or the one throttled
+    least recently. A jar that gets a 403 or "Sign in to confirm" cools down
+    for cooldown_seconds, and no jar is handed out while all of them are
+    cooling down.
+    """
+
+    def __init__(self, directory='cookies', legacy_file='cookies.txt', strategy='round_robin',
+                 cooldown_seconds=900, rescan_seconds=30):
+        self.directory = directory
+        self.legacy_file = legacy_file
+        self.strategy = strategy
+        self.cooldown_seconds = float(cooldown_seconds)
+        self.rescan_seconds = float(rescan_seconds)
+        self._jars = {}  # path -> CookieJarEntry
+        self._next = 0
+        self._scanned_at = None
+        self._lock = threading.Lock()
+
+    def _paths(self):
+        paths = []
+        if os.path.isdir(self.directory):
+            paths = [os.path.join(self.directory, name) for name in sorted(os.listdir(self.directory))
+                     if name.endswith('.txt')]
+        if self.legacy_file and os.path.isfile(self.legacy_file):
+            paths.insert(0, self.legacy_file)
+        return paths
+
+    def refresh(self, force=False):
+        """Pick up added, changed and removed cookie files"""
+        with self._lock:
+            if not force and self._scanned_at and time.monotonic() - self._scanned_at < self.rescan_seconds:
+                return
+            self._scanned_at = time.monotonic()
+            known = dict(self._jars)
+
+        jars = {}
+        for path in self._paths():
+            try:
+                mtime = os.path.getmtime(path)
+                entry = known.get(path)
+                if entry and entry.mtime == mtime:
+                    jars[path] = entry
+                    continue
+                cookies = load_cookie_file(path)
+                if entry:
+                    # Same identity with fresh cookies: keep its history
+                    entry.cookies, entry.mtime, entry.size = cookies, mtime, os.path.getsize(path)
+                    jars[path] = entry
+                else:
+                    jars[path] = CookieJarEntry(path, cookies, mtime, os.path.getsize(path))
+                logger.info(f"Loaded cookie jar {path} ({len(cookies)} cookies)")
+            except Exception as e:
+                logger.warning(f"Skipping cookie file {path}: {str(e)}")
+
+        with self._lock:
+            self._jars = jars
+
+    def acquire(self):
+        """A jar to use for one download or lookup, or None if none is usable"""
+        self.refresh()
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._jars.values())
+            ready = [entry for entry in entries if entry.cooldown_until <= now]
+            if not ready:
+                if entries:
+                    logger.warning("All cookie jars are cooling down; continuing without cookies")
+                return None
+            if self.strategy == 'least_throttled':
+                entry = min(ready, key=lambda e: (e.last_throttled, e.uses))
+            else:
+                # Round-robin over the full list so positions stay stable as jars cool down
+                for offset in range(len(entries)):
+                    entry = entries[(self._next + offset) % len(entries)]
+                    if entry.cooldown_until <= now:
+                        self._next = (self._next + offset + 1) % len(entries)
+                        break
+            entry.uses += 1
+            return entry
+
+    def report_error(self, entry, error_class):
+        """Start a cool-down when an error says the identity is being throttled"""
+        if entry is None or error_class not in THROTTLE_ERROR_CLASSES:
+            return
+        with self._lock:
+            now = time.monotonic()
+            entry.throttles += 1
+            entry.last_throttled = now
+            entry.cooldown_until = now + self.cooldown_seconds
+        logger.warning(f"Cookie jar {entry.name} throttled ({error_class}); cooling down for {self.cooldown_seconds:.0f}s")
+
+    def add(self, file_storage, filename):
+        """Validate an uploaded cookies file and add it to the pool; returns the saved path"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, filename)
+        temp_path = path + '.upload'
+        file_storage.save(temp_path)
+        try:
+            if not len(load_cookie_file(temp_path)):
+                raise ValueError('file contains no cookies')
+        except Exception:
+            os.remove(temp_path)
+            raise
+        os.replace(temp_path, path)
+        self.refresh(force=True)
+        return path
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._jars.values())
+            return {
+                'directory': self.directory,
+                'strategy': self.strategy,
+                'jars': len(entries),
+                'available': sum(1 for entry in entries if entry.cooldown_until <= now),
+                'total_bytes': sum(entry.size for entry in entries),
+                'cooldown_seconds': self.cooldown_seconds,
+                'identities': [entry.stats(now) for entry in entries]
+            }
+
+cookie_pool = CookiePool(
+    directory=os.environ.get('COOKIES_DIR', 'cookies'),
+    strategy=os.environ.get('COOKIE_POOL_STRATEGY', 'round_robin'),
+    cooldown_seconds=os.environ.get('COOKIE_COOLDOWN_SECONDS', 900),
+    rescan_seconds=os.environ.get('COOKIE_RESCAN_SECONDS', 30)
+)
@@ -1,14 +1,27 @@
 import os
-import yt_dlp
+import copy
+import time
 import subprocess
+import threading
 import logging
-from utils import sanitize_filename
+from functools import partial
+from utils import sanitize_filename, extract_video_id, job_output_dir, get_video_format_info
+from cache import metadata_cache
+from progress import progress_hook_event
+from transcoder import transcoder, probe_audio_codec
+from planner import rank_video_formats, rank_audio_formats
+from tuner import throughput_tuner
+from metrics import stage_seconds, method_attempts, errors_total, bytes_total, classify_error
+from breaker import method_breaker
+from hedging import extraction_hedger
+from cookie_pool import cookie_pool
 
 logger = logging.getLogger(__name__)
 
 class YouTubeDownloader:
-    def __init__(self):
+    def __init__(self, progress_callback=None, job_key=None):
         self.downloads_dir = 'downloads'
+        self.job_key = job_key  # names this run's output directory (see job_output_dir)
         os.makedirs(self.downloads_dir, exist_ok=True)
         
         # Video quality mapping
@@ -28,6 +41,13 @@ class YouTubeDownloader:
             '320kbps': '320'
         }
         
+        # Native audio containers: the source stream is remuxed with stream copy
+        # when its codec fits, and only re-encoded (at 'bitrate') when it does not
+        self.native_audio_formats = {
+            'm4a': {'format': 'bestaudio[ext=m4a]/bestaudio/best', 'codecs': ('mp4a', 'aac'), 'encoder': 'aac', 'bitrate': '192'},
+            'opus': {'format': 'bestaudio[acodec=opus]/bestaudio/best', 'codecs': ('opus',), 'encoder': 'libopus', 'bitrate': '160'}
+        }
+        
         # Enhanced anti-detection options for Railway deployment
         self.base_ydl_opts = {
             'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
@@ -67,11 +87,11 @@ class YouTubeDownloader:
             'ignoreerrors': False,
         }
         
-        # Enhanced cookie handling for Railway
-        cookies_file = os.path.join(os.getcwd(), 'cookies.txt')
-        if os.path.exists(cookies_file):
-            self.base_ydl_opts['cookiefile'] = cookies_file
-            logger.info(f"Using cookies file: {cookies_file}")
+        # Enhanced cookie handling for Railway: one identity from the shared pool per downloader
+        self.cookie_jar = cookie_pool.acquire()
+        if self.cookie_jar:
+            self.base_ydl_opts['cookiefile'] = self.cookie_jar.path
+            logger.info(f"Using cookie jar: {self.cookie_jar.name}")
         else:
             logger.warning("No cookies file found - downloads may be limited")
             # Add additional anti-detection when no cookies
@@ -83,9 +103,106 @@ class YouTubeDownloader:
                     }
                 }
             })
+        
+        # Progress reporting: yt-dlp hooks are forwarded as progress_callback(stage, **fields)
+        # and finished transfers feed the throughput tuner
+        self.progress_callback = progress_callback
+        self.planned_bytes = None
+        self._fragmented = False
+        self.hook_opts = {'progress_hooks': [self._on_download_progress]}
+        if progress_callback:
+            self.hook_opts['postprocessor_hooks'] = [self._on_postprocess_progress]
+        self.base_ydl_opts.update(self.hook_opts)
+    
+    def _on_download_progress(self, d):
+        """yt-dlp progress hook"""
+        if d.get('status') == 'downloading':
+            self._fragmented = self._fragmented or d.get('fragment_index') is not None
+            if self.progress_callback:
+                self.progress_callback('downloading', **progress_hook_event(d))
+        elif d.get('status') == 'finished':
+            connections = self.base_ydl_opts.get('concurrent_fragment_downloads', 1) if self._fragmented else 1
+            throughput_tuner.record(d.get('total_bytes') or d.get('downloaded_bytes'), d.get('elapsed'), connections)
+            bytes_total.inc(d.get('total_bytes') or d.get('downloaded_bytes') or 0, direction='downloaded')
+            self._fragmented = False
+            if self.progress_callback:
+                self.progress_callback('downloaded', **progress_hook_event(d))
+    
+    def _tune(self, expected_bytes=None):
+        """Apply fragment concurrency and chunk size for the transfer about to start"""
+        self.base_ydl_opts.update(throughput_tuner.options(expected_bytes))
     
-    def get_video_info(self, url):
-        """Get video information without downloading"""
+    def _on_postprocess_progress(self, d):
+        """yt-dlp postprocessor hook"""
+        self.progress_callback('postprocessing', postprocessor=d.get('postprocessor'), status=d.get('status'))
+    
+    def get_video_info(self, url, use_cache=True):
+        """Get video information without downloading (use_cache=False when the caller already missed)"""
+        video_id = extract_video_id(url)
+        cached = metadata_cache.get(video_id) if use_cache else None
+        if cached:
+            logger.info(f"Video info cache hit for {video_id}")
+            return cached
+        
+        raw_info = self._extract_raw_info(url)
+        return self._summarize_info(raw_info, url)
+    
+    def get_playlist_entries(self, playlist_url, limit=500):
+        """List playlist video URLs using flat extraction (no per-video resolution)"""
+        ydl_opts = {
+            **self.base_ydl_opts,
+            'quiet': True,
+            'no_warnings': True,
+            'extract_flat': 'in_playlist',
+            'playlistend': limit,
+        }
+        
+        try:
+            with self._youtube_dl(ydl_opts) as ydl:
+                info = ydl.extract_info(playlist_url, download=False)
+        except Exception as e:
+            logger.error(f"Playlist extraction failed: {str(e)}")
+            raise Exception(f"Failed to get playlist entries: {str(e)}")
+        
+        entries = []
+        for entry in (info or {}).get('entries') or []:
+            if entry and entry.get('id'):
+                entries.append({
+                    'url': f"https://www.youtube.com/watch?v={entry['id']}",
+                    'title': entry.get('title')
+                })
+        return entries[:limit]
+    
+    def _summarize_info(self, info, url):
+        """Build the public info dict from a yt-dlp info dict and cache it"""
+        # Extract info with type safety
+        title = info.get('title') if info else 'Unknown'
+        duration = info.get('duration') if info else 0
+        uploader = info.get('uploader') if info else 'Unknown'
+        view_count = info.get('view_count') if info else 0
+        upload_date = info.get('upload_date') if info else ''
+        description = info.get('description') if info else ''
+        thumbnail = info.get('thumbnail') if info else ''
+        webpage_url = info.get('webpage_url') if info else url
+        
+        if description and len(description) > 200:
+            description = description[:200] + '...'
+        
+        result = {
+            'title': title or 'Unknown',
+            'duration': duration or 0,
+            'uploader': uploader or 'Unknown',
+            'view_count': view_count or 0,
+            'upload_date': upload_date or '',
+            'description': description or '',
+            'thumbnail': thumbnail or '',
+            'webpage_url': webpage_url or url
+        }
+        metadata_cache.set(info.get('id') or extract_video_id(url), result)
+        return result
+    
+    def _extract_raw_info(self, url):
+        """Run yt-dlp extraction and return the full info dict"""
         # Try multiple extraction methods for better reliability
         extraction_methods = [
             # Method 1: Standard with cookies
@@ -115,46 +232,28 @@ class YouTubeDownloader:
             }
         ]
         
+        started = time.monotonic()
         last_error = None
-        for i, ydl_opts in enumerate(extraction_methods):
+        ordered_methods = method_breaker.order('extract', extraction_methods)
+        if extraction_hedger.enabled:
             try:
-                logger.info(f"Attempting video info extraction method {i+1}")
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
-                    
-                    if not info:
-                        raise Exception("Could not extract video information")
-                    
-                    # Extract info with type safety
-                    title = info.get('title') if info else 'Unknown'
-                    duration = info.get('duration') if info else 0
-                    uploader = info.get('uploader') if info else 'Unknown'
-                    view_count = info.get('view_count') if info else 0
-                    upload_date = info.get('upload_date') if info else ''
-                    description = info.get('description') if info else ''
-                    thumbnail = info.get('thumbnail') if info else ''
-                    webpage_url = info.get('webpage_url') if info else url
-                    
-                    if description and len(description) > 200:
-                        description = description[:200] + '...'
-                    
-                    logger.info(f"Successfully extracted video info using method {i+1}")
-                    return {
-                        'title': title or 'Unknown',
-                        'duration': duration or 0,
-                        'uploader': uploader or 'Unknown',
-                        'view_count': view_count or 0,
-                        'upload_date': upload_date or '',
-                        'description': description or '',
-                        'thumbnail': thumbnail or '',
-                        'webpage_url': webpage_url or url
-                    }
-                    
+                info = extraction_hedger.run([partial(self._try_extraction, url, i, ydl_opts)
+                                              for i, ydl_opts in ordered_methods])
+                stage_seconds.observe(time.monotonic() - started, stage='extract')
+                return info
             except Exception as e:
                 last_error = e
-                logger.warning(f"Video info extraction method {i+1} failed: {str(e)}")
-                if i < len(extraction_methods) - 1:
-                    continue
+        else:
+            for i, ydl_opts in ordered_methods:
+                try:
+                    info = self._try_extraction(url, i, ydl_opts)
+                    stage_seconds.observe(time.monotonic() - started, stage='extract')
+                    return info
+                except Exception as e:
+                    last_error = e
+        
+        stage_seconds.observe(time.monotonic() - started, stage='extract')
+        errors_total.inc(operation='extract', error_class=classify_error(last_error))
         
         # If all methods failed
         error_msg = str(last_error) if last_error else "Unknown error"
@@ -166,23 +265,154 @@ class YouTubeDownloader:
         logger.error(f"All video info extraction methods failed: {error_msg}")
         raise Exception(f"Failed to get video information: {error_msg}")
     
+    def _youtube_dl(self, ydl_opts):
+        """YoutubeDL that shares the pooled in-memory cookie jar instead of reparsing cookiefile"""
+        # yt-dlp is imported on first use: it is the largest import in the app and
+        # keeping it out of the import path lets a fresh worker answer /health sooner
+        import yt_dlp
+        jar = self.cookie_jar
+        if not jar or ydl_opts.get('cookiefile') != jar.path:
+            return yt_dlp.YoutubeDL(ydl_opts)
+        # Without cookiefile yt-dlp neither reads nor rewrites the file; cookiejar is a
+        # cached_property, so seeding it hands every instance the same parsed jar
+        ydl = yt_dlp.YoutubeDL({key: value for key, value in ydl_opts.items() if key != 'cookiefile'})
+        ydl.__dict__['cookiejar'] = jar.cookies
+        return ydl
+    
+    def _report_cookie_error(self, ydl_opts, error):
+        # Only attempts that sent the jar say anything about it
+        if ydl_opts.get('cookiefile'):
+            cookie_pool.report_error(self.cookie_jar, classify_error(error))
+    
+    def _try_extraction(self, url, i, ydl_opts):
+        """One extraction method; records its outcome and raises on failure"""
+        attempt_started = time.monotonic()
+        try:
+            logger.info(f"Attempting video info extraction method {i+1}")
+            with self._youtube_dl(ydl_opts) as ydl:
+                info = ydl.extract_info(url, download=False)
+                
+                if not info:
+                    raise Exception("Could not extract video information")
+                
+                logger.info(f"Successfully extracted video info using method {i+1}")
+                method_attempts.inc(operation='extract', method=i+1, result='success')
+                method_breaker.record('extract', i, True, time.monotonic() - attempt_started)
+                return info
+                
+        except Exception as e:
+            method_attempts.inc(operation='extract', method=i+1, result='failure')
+            method_breaker.record('extract', i, False, time.monotonic() - attempt_started, classify_error(e))
+            self._report_cookie_error(ydl_opts, e)
+            logger.warning(f"Video info extraction method {i+1} failed: {str(e)}")
+            raise
+    
+    def _run_download(self, ydl, url, raw_info=None):
+        """Download from an already-resolved info dict, or extract again if none is given"""
+        with throughput_tuner.transfer(), stage_seconds.time(stage='download'):
+            if raw_info:
+                # process_ie_result mutates the dict, so keep the caller's copy intact
+                return ydl.process_ie_result(copy.deepcopy(raw_info), download=True)
+            return ydl.extract_info(url, download=True)
+    
+    def _downloaded_file_path(self, result_info, output_dir):
+        """Final file path as reported by yt-dlp (after postprocessors ran)"""
+        for download in (result_info or {}).get('requested_downloads') or []:
+            if download.get('filepath') and os.path.exists(download['filepath']):
+                # yt-dlp reports absolute paths; store them like the rest of downloads/
+                return os.path.relpath(download['filepath'])
+        
+        # The run's directory only ever holds this run's output
+        if os.path.isdir(output_dir):
+            files = [f for f in os.listdir(output_dir) if not f.endswith(('.part', '.ytdl', '.temp'))]
+            if len(files) == 1:
+                return os.path.join(output_dir, files[0])
+        return None
+    
+    def rank_formats(self, raw_info, format_type, quality):
+        """Planner candidates for a request, best first (empty if nothing qualifies)"""
+        if format_type == 'video':
+            if quality == '3gp':
+                # Like 'worst[height<=240]/worst': the smallest file, at any height if need be
+                return (rank_video_formats(raw_info, 240, smallest=True)
+                        or rank_video_formats(raw_info, float('inf'), smallest=True))
+            max_height = int(quality.rstrip('p')) if quality.rstrip('p').isdigit() else 720
+            return rank_video_formats(raw_info, max_height)
+        
+        native = self.native_audio_formats.get(quality)
+        if native:
+            return rank_audio_formats(raw_info, codecs=native['codecs'])
+        return rank_audio_formats(raw_info, min_abr=int(self.audio_qualities.get(quality, '256')))
+    
+    def get_formats(self, url, format_type=None, quality=None):
+        """Available formats and the planner's choice for every supported quality
+        
+        With format_type and quality, the full ranked candidate list for that
+        request is included as well.
+        """
+        raw_info = self._extract_raw_info(url)
+        info = self._summarize_info(raw_info, url)
+        
+        plans = {'video': {}, 'audio': {}}
+        for q in self.video_formats:
+            ranked = self.rank_formats(raw_info, 'video', q)
+            plans['video'][q] = ranked[0] if ranked else None
+        for q in list(self.audio_qualities) + list(self.native_audio_formats):
+            ranked = self.rank_formats(raw_info, 'audio', q)
+            plans['audio'][q] = ranked[0] if ranked else None
+        
+        result = {
+            'video_id': raw_info.get('id'),
+            'title': info['title'],
+            'duration': info['duration'],
+            'formats': get_video_format_info(raw_info),
+            'plans': plans
+        }
+        if format_type and quality:
+            result['candidates'] = self.rank_formats(raw_info, format_type, quality)
+        return result
+    
+    def plan_format(self, raw_info, format_type, quality):
+        """yt-dlp options for the planner's choice; empty to keep the fixed selector"""
+        self.planned_bytes = None
+        try:
+            plans = self.rank_formats(raw_info, format_type, quality)
+        except Exception as e:
+            logger.warning(f"Format planning failed: {str(e)}")
+            return {}
+        if not plans:
+            return {}
+        
+        plan = plans[0]
+        self.planned_bytes = plan['expected_bytes']
+        logger.info(f"Planned format {plan['format']} for {format_type} {quality} "
+                    f"(expected {plan['expected_bytes']} bytes, merge={plan['merge']})")
+        opts = {'format': plan['format']}
+        if plan['merge']:
+            opts['merge_output_format'] = 'mp4'
+        return opts
+    
     def download_video(self, url, quality='720p'):
         """Download video in specified quality"""
         try:
-            # Get video info first
-            info = self.get_video_info(url)
+            # Resolve the video once and reuse the result for the download
+            raw_info = self._extract_raw_info(url)
+            info = self._summarize_info(raw_info, url)
             title = sanitize_filename(info['title'])
             
             # Special handling for 3GP format
             if quality == '3gp':
-                return self._download_3gp_video(url, title, info)
+                return self._download_3gp_video(url, title, info, raw_info)
             
             format_selector = self.video_formats.get(quality, 'best[height<=720]')
-            output_path = os.path.join(self.downloads_dir, f"{title}_{quality}.%(ext)s")
+            planned = self.plan_format(raw_info, 'video', quality)
+            self._tune(self.planned_bytes)
+            output_dir = job_output_dir(raw_info.get('id') or extract_video_id(url), quality, self.downloads_dir, self.job_key)
+            output_path = os.path.join(output_dir, f"{title}_{quality}.%(ext)s")
             
             # Try multiple download methods
             download_methods = [
-                # Method 1: Standard download with cookies
+                # Method 1: Standard download with cookies, using the planned format
                 {
                     **self.base_ydl_opts,
                     'format': format_selector,
@@ -190,6 +420,7 @@ class YouTubeDownloader:
                     'noplaylist': True,
                     'extractaudio': False,
                     'prefer_ffmpeg': True,
+                    **planned,
                 },
                 # Method 2: Android client fallback
                 {
@@ -209,31 +440,20 @@ class YouTubeDownloader:
             ]
             
             last_error = None
-            for i, ydl_opts in enumerate(download_methods):
+            for i, ydl_opts in method_breaker.order('video_download', download_methods):
+                attempt_started = time.monotonic()
                 try:
                     logger.info(f"Attempting video download method {i+1}")
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        ydl.download([url])
-                    
-                    # Find the actual downloaded file
-                    expected_extensions = ['mp4', 'webm', 'mkv']
-                    actual_file_path = None
+                    with self._youtube_dl(ydl_opts) as ydl:
+                        # Fallback methods use a different client, so they resolve afresh
+                        result_info = self._run_download(ydl, url, raw_info if i == 0 else None)
                     
-                    for ext in expected_extensions:
-                        potential_path = output_path.replace('%(ext)s', ext)
-                        if os.path.exists(potential_path):
-                            actual_file_path = potential_path
-                            break
-                    
-                    if not actual_file_path:
-                        # Fallback: look for any file with the title prefix
-                        for file in os.listdir(self.downloads_dir):
-                            if file.startswith(f"{title}_{quality}"):
-                                actual_file_path = os.path.join(self.downloads_dir, file)
-                                break
+                    actual_file_path = self._downloaded_file_path(result_info, output_dir)
                     
                     if actual_file_path and os.path.exists(actual_file_path):
                         logger.info(f"Successfully downloaded video using method {i+1}")
+                        method_attempts.inc(operation='video_download', method=i+1, result='success')
+                        method_breaker.record('video_download', i, True, time.monotonic() - attempt_started)
                         return {
                             'title': info['title'],
                             'file_path': actual_file_path,
@@ -245,9 +465,10 @@ class YouTubeDownloader:
                         
                 except Exception as e:
                     last_error = e
+                    method_attempts.inc(operation='video_download', method=i+1, result='failure')
+                    method_breaker.record('video_download', i, False, time.monotonic() - attempt_started, classify_error(e))
+                    self._report_cookie_error(ydl_opts, e)
                     logger.warning(f"Video download method {i+1} failed: {str(e)}")
-                    if i < len(download_methods) - 1:
-                        continue
             
             # If all methods failed
             error_msg = str(last_error) if last_error else "Unknown error"
@@ -263,38 +484,27 @@ class YouTubeDownloader:
             logger.error(f"Video download failed: {str(e)}")
             raise Exception(f"Video download failed: {str(e)}")
     
-    def _download_3gp_video(self, url, title, info):
+    def _download_3gp_video(self, url, title, info, raw_info=None):
         """Download video and convert to 3GP format"""
         try:
             # Download in low quality first
-            temp_output = os.path.join(self.downloads_dir, f"temp_{title}.%(ext)s")
-            final_output = os.path.join(self.downloads_dir, f"{title}_3gp.mp4")
+            video_id = (raw_info or {}).get('id') or extract_video_id(url)
+            output_dir = job_output_dir(video_id, '3gp', self.downloads_dir, self.job_key)
+            temp_output = os.path.join(output_dir, f"temp_{title}.%(ext)s")
+            final_output = os.path.join(output_dir, f"{title}_3gp.mp4")
             
             ydl_opts = {
                 'format': 'worst[height<=240]/worst',
                 'outtmpl': temp_output,
                 'noplaylist': True,
+                **self.hook_opts,
+                **(self.plan_format(raw_info, 'video', '3gp') if raw_info else {}),
             }
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
-            
-            # Find the downloaded temp file
-            temp_file_path = None
-            expected_extensions = ['mp4', 'webm', 'mkv', 'flv']
-            
-            for ext in expected_extensions:
-                potential_path = temp_output.replace('%(ext)s', ext)
-                if os.path.exists(potential_path):
-                    temp_file_path = potential_path
-                    break
+            with self._youtube_dl(ydl_opts) as ydl:
+                result_info = self._run_download(ydl, url, raw_info)
             
-            if not temp_file_path:
-                # Fallback: look for any temp file
-                for file in os.listdir(self.downloads_dir):
-                    if file.startswith(f"temp_{title}"):
-                        temp_file_path = os.path.join(self.downloads_dir, file)
-                        break
+            temp_file_path = self._downloaded_file_path(result_info, output_dir)
             
             if not temp_file_path or not os.path.exists(temp_file_path):
                 raise Exception("Temporary video file not found")
@@ -314,41 +524,47 @@ class YouTubeDownloader:
             logger.error(f"3GP video download failed: {str(e)}")
             raise Exception(f"3GP video download failed: {str(e)}")
     
-    def download_audio(self, url, quality='256kbps'):
-        """Download audio in specified quality"""
+    def download_audio(self, url, quality='256kbps', defer_transcode=False):
+        """Download audio in specified quality
+        
+        The source stream is fetched here and encoded to MP3 on the transcode
+        scheduler. Native qualities ('m4a', 'opus') are remuxed with stream copy
+        instead when the source codec allows it; result['processing'] says
+        which path was taken. With defer_transcode the encode is not started;
+        the result carries a 'transcode' dict for the caller to hand to
+        transcode_audio().
+        """
         try:
-            # Get video info first
-            info = self.get_video_info(url)
+            # Resolve the video once and reuse the result for the download
+            raw_info = self._extract_raw_info(url)
+            info = self._summarize_info(raw_info, url)
             title = sanitize_filename(info['title'])
+            native = self.native_audio_formats.get(quality)
+            format_selector = native['format'] if native else 'bestaudio/best'
+            planned = self.plan_format(raw_info, 'audio', quality)
+            self._tune(self.planned_bytes)
             
-            # Direct audio download with yt-dlp postprocessor
-            final_output = os.path.join(self.downloads_dir, f"{title}_{quality}.mp3")
+            # Fetch the best audio stream as-is; encoding (if any) happens afterwards
+            output_dir = job_output_dir(raw_info.get('id') or extract_video_id(url), quality, self.downloads_dir, self.job_key)
+            final_output = os.path.join(output_dir, f"{title}_{quality}.{quality if native else 'mp3'}")
+            source_template = os.path.join(output_dir, f"{title}_{quality}.source.%(ext)s")
             
             # Try multiple download methods
             download_methods = [
-                # Method 1: Standard audio download with cookies
+                # Method 1: Standard audio download with cookies, using the planned format
                 {
                     **self.base_ydl_opts,
-                    'format': 'bestaudio/best',
-                    'outtmpl': final_output.replace('.mp3', '.%(ext)s'),
+                    'format': format_selector,
+                    'outtmpl': source_template,
                     'noplaylist': True,
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': self.audio_qualities.get(quality, '256'),
-                    }],
+                    **planned,
                 },
                 # Method 2: Android client fallback
                 {
                     **self.base_ydl_opts,
-                    'format': 'bestaudio/best',
-                    'outtmpl': final_output.replace('.mp3', '.%(ext)s'),
+                    'format': format_selector,
+                    'outtmpl': source_template,
                     'noplaylist': True,
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': self.audio_qualities.get(quality, '256'),
-                    }],
                     'extractor_args': {
                         'youtube': {
                             'player_client': ['android'],
@@ -358,85 +574,311 @@ class YouTubeDownloader:
                 }
             ]
             
+            source_path = None
+            source_codec = ''
             last_error = None
-            for i, ydl_opts in enumerate(download_methods):
+            for i, ydl_opts in method_breaker.order('audio_download', download_methods):
+                attempt_started = time.monotonic()
                 try:
                     logger.info(f"Attempting audio download method {i+1}")
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        ydl.download([url])
+                    with self._youtube_dl(ydl_opts) as ydl:
+                        # Fallback methods use a different client, so they resolve afresh
+                        result_info = self._run_download(ydl, url, raw_info if i == 0 else None)
                     
-                    # Check if the file was created
-                    if os.path.exists(final_output):
-                        actual_file_path = final_output
-                    else:
-                        # Look for the file with different extension
-                        base_name = final_output.replace('.mp3', '')
-                        actual_file_path = None
-                        
-                        for file in os.listdir(self.downloads_dir):
-                            if file.startswith(os.path.basename(base_name)) and file.endswith(('.mp3', '.m4a', '.webm', '.opus')):
-                                actual_file_path = os.path.join(self.downloads_dir, file)
-                                break
+                    actual_file_path = self._downloaded_file_path(result_info, output_dir)
                     
                     if actual_file_path and os.path.exists(actual_file_path):
                         logger.info(f"Successfully downloaded audio using method {i+1}")
-                        return {
-                            'title': info['title'],
-                            'file_path': actual_file_path,
-                            'format': 'audio',
-                            'quality': quality
-                        }
+                        method_attempts.inc(operation='audio_download', method=i+1, result='success')
+                        method_breaker.record('audio_download', i, True, time.monotonic() - attempt_started)
+                        source_path = actual_file_path
+                        source_codec = self._downloaded_audio_codec(result_info)
+                        break
                     else:
                         raise Exception("Audio file not found after download")
                 
                 except Exception as e:
                     last_error = e
+                    method_attempts.inc(operation='audio_download', method=i+1, result='failure')
+                    method_breaker.record('audio_download', i, False, time.monotonic() - attempt_started, classify_error(e))
+                    self._report_cookie_error(ydl_opts, e)
                     logger.warning(f"Audio download method {i+1} failed: {str(e)}")
-                    if i < len(download_methods) - 1:
-                        continue
             
-            # If all methods failed
-            error_msg = str(last_error) if last_error else "Unknown error"
-            if "403" in error_msg or "Forbidden" in error_msg:
-                error_msg = "YouTube blocked this download. Please upload cookies.txt file or try again later."
-            elif "Sign in to confirm" in error_msg:
-                error_msg = "YouTube requires sign-in verification. Please upload cookies.txt file."
+            if source_path is None:
+                # If all methods failed
+                error_msg = str(last_error) if last_error else "Unknown error"
+                if "403" in error_msg or "Forbidden" in error_msg:
+                    error_msg = "YouTube blocked this download. Please upload cookies.txt file or try again later."
+                elif "Sign in to confirm" in error_msg:
+                    error_msg = "YouTube requires sign-in verification. Please upload cookies.txt file."
+                
+                logger.error(f"All audio download methods failed: {error_msg}")
+                raise Exception(f"Audio download failed: {error_msg}")
             
-            logger.error(f"All audio download methods failed: {error_msg}")
-            raise Exception(f"Audio download failed: {error_msg}")
+            result = {
+                'title': info['title'],
+                'file_path': final_output,
+                'format': 'audio',
+                'quality': quality
+            }
+            return self._finish_audio(result, source_path, source_codec, defer_transcode)
             
         except Exception as e:
             logger.error(f"Audio download failed: {str(e)}")
             raise Exception(f"Audio download failed: {str(e)}")
     
-    def convert_video_to_audio(self, video_path, quality='256kbps'):
-        """Convert existing video file to audio"""
+    def _finish_audio(self, result, source_path, source_codec, defer_transcode=False, keep_source=False):
+        """Turn a source file into result['file_path']: stream copy when the codec fits, else encode"""
+        native = self.native_audio_formats.get(result['quality'])
+        if native and source_codec.startswith(native['codecs']):
+            self.remux_audio(source_path, result['file_path'], keep_source=keep_source)
+            result['processing'] = 'stream_copy'
+            return result
+        
+        transcode = {
+            'source_path': source_path,
+            'output_path': result['file_path'],
+            'bitrate': native['bitrate'] if native else self.audio_qualities.get(result['quality'], '256'),
+            'codec': native['encoder'] if native else 'libmp3lame',
+            'keep_source': keep_source
+        }
+        result['processing'] = 'transcode'
+        if defer_transcode:
+            result['transcode'] = transcode
+        else:
+            self.transcode_audio(**transcode)
+        return result
+    
+    def _downloaded_audio_codec(self, result_info):
+        """Audio codec of the format yt-dlp actually downloaded, '' if unknown"""
+        for download in (result_info or {}).get('requested_downloads') or [result_info or {}]:
+            if download.get('acodec') not in (None, 'none'):
+                return download['acodec']
+        return ''
+    
+    def remux_audio(self, source_path, output_path, keep_source=False):
+        """Copy the audio stream into a new container without re-encoding
+        
+        This is I/O-bound, so it runs inline rather than on the transcode
+        scheduler, and the source file is removed afterwards unless keep_source.
+        """
+        if self.progress_callback:
+            self.progress_callback('postprocessing', postprocessor='stream_copy', status='started')
+        with stage_seconds.time(stage='remux'):
+            result = subprocess.run(transcoder.remux_cmd(source_path, output_path), capture_output=True, text=True)
+        if not keep_source and os.path.exists(source_path):
+            os.remove(source_path)
+        if result.returncode != 0:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise Exception(f"Audio remux failed: {result.stderr}")
+        if self.progress_callback:
+            self.progress_callback('postprocessing', postprocessor='stream_copy', status='finished')
+    
+    def transcode_audio(self, source_path, output_path, bitrate, codec='libmp3lame', keep_source=False, callback=None):
+        """Encode a source file on the transcode scheduler (MP3 unless codec says otherwise)
+        
+        Blocks until ffmpeg finishes unless a callback(error) is given, in
+        which case it returns once the job is queued. The source file is
+        removed afterwards unless keep_source, and a partial output on failure.
+        """
+        def finish(error):
+            if not keep_source and os.path.exists(source_path):
+                os.remove(source_path)
+            if error and os.path.exists(output_path):
+                os.remove(output_path)
+            if self.progress_callback:
+                self.progress_callback('postprocessing', postprocessor='transcode',
+                                       status='error' if error else 'finished')
+            if callback:
+                callback(error)
+        
+        if self.progress_callback:
+            self.progress_callback('postprocessing', postprocessor='transcode', status='queued')
+        future = transcoder.submit(transcoder.audio_cmd(source_path, output_path, bitrate, codec), finish)
+        if callback is None:
+            error = future.result()
+            if error:
+                raise Exception(f"Audio conversion failed: {str(error)}")
+    
+    def open_stream(self, url, format_type='video', quality='720p'):
+        """Resolve a video and return an iterator over its bytes for stream-through serving
+        
+        result['quality'] is the quality the stream really has, which for video
+        can be below the one requested.
+        """
+        raw_info = self._extract_raw_info(url)
+        info = self._summarize_info(raw_info, url)
+        
+        native = self.native_audio_formats.get(quality) if format_type == 'audio' else None
+        if native:
+            # Native audio passes through untouched, in the container YouTube serves it in
+            fmt = self._select_stream_format(raw_info, audio_only=True, codecs=native['codecs'])
+            ext = fmt.get('ext') or quality
+            return {
+                'title': info['title'],
+                'video_id': raw_info.get('id'),
+                'quality': quality,
+                'ext': ext,
+                'mimetype': 'audio/mp4' if ext == 'm4a' else f'audio/{ext}',
+                'filesize': fmt.get('filesize'),
+                'processing': 'stream_copy',
+                'chunks': self._iter_format_bytes(fmt)
+            }
+        
+        if format_type == 'audio':
+            fmt = self._select_stream_format(raw_info, audio_only=True)
+            bitrate = self.audio_qualities.get(quality, '256')
+            return {
+                'title': info['title'],
+                'video_id': raw_info.get('id'),
+                'quality': quality,
+                'ext': 'mp3',
+                'mimetype': 'audio/mpeg',
+                'filesize': None,
+                'processing': 'transcode',
+                'chunks': self._iter_mp3_encode(self._iter_format_bytes(fmt), bitrate)
+            }
+        
+        if quality == '3gp':
+            fmt = self._select_stream_format(raw_info, max_height=240, prefer_smallest=True)
+        else:
+            fmt = self._select_stream_format(raw_info, max_height=int(quality.rstrip('p')) if quality.endswith('p') else 720)
+        # Progressive formats top out around 360p on YouTube, so report the quality
+        # actually served (None if it matches no quality we offer)
+        served = f"{fmt['height']}p" if fmt.get('height') else None
+        return {
+            'title': info['title'],
+            'video_id': raw_info.get('id'),
+            'quality': quality if quality == '3gp' else (served if served in self.video_formats else None),
+            'ext': fmt.get('ext') or 'mp4',
+            'mimetype': f"video/{fmt.get('ext') or 'mp4'}",
+            'filesize': fmt.get('filesize'),
+            'chunks': self._iter_format_bytes(fmt)
+        }
+    
+    def _select_stream_format(self, raw_info, max_height=None, audio_only=False, prefer_smallest=False, codecs=None):
+        """Pick a single-file HTTP format that can be piped without merging"""
+        candidates = []
+        for f in raw_info.get('formats') or []:
+            if not f.get('url') or f.get('protocol') not in ('http', 'https'):
+                continue
+            has_video = f.get('vcodec') not in (None, 'none')
+            has_audio = f.get('acodec') not in (None, 'none')
+            if audio_only:
+                if codecs and not (f.get('acodec') or '').startswith(codecs):
+                    continue
+                if has_audio and not has_video:
+                    candidates.append(((f.get('abr') or f.get('tbr') or 0), f))
+            elif has_video and has_audio:
+                height = f.get('height') or 0
+                if max_height and height > max_height:
+                    continue
+                rank = (-height, -(f.get('tbr') or 0)) if prefer_smallest else (height, f.get('tbr') or 0)
+                candidates.append((rank, f))
+        
+        if not candidates and audio_only and codecs:
+            raise Exception("No native audio stream available for this quality")
+        if not candidates and audio_only:
+            # No audio-only stream: transcode from the smallest progressive format
+            return self._select_stream_format(raw_info, prefer_smallest=True)
+        if not candidates:
+            raise Exception("No streamable format available for this quality")
+        
+        return max(candidates, key=lambda c: c[0])[1]
+    
+    def _iter_format_bytes(self, fmt, block_size=65536):
+        """Fetch a format over HTTP in ranged chunks, yielding blocks as they arrive"""
+        from yt_dlp.networking import Request
+        # Client-paced, so it counts towards load but is not recorded as link throughput
+        total = fmt.get('filesize')
+        chunk_size = throughput_tuner.options(total)['http_chunk_size']
+        start = 0
+        
+        with throughput_tuner.transfer(), self._youtube_dl({**self.base_ydl_opts, 'quiet': True}) as ydl:
+            while True:
+                end = start + chunk_size - 1
+                if total:
+                    end = min(end, total - 1)
+                requested = end - start + 1
+                headers = {**(fmt.get('http_headers') or {}), 'Range': f'bytes={start}-{end}'}
+                
+                received = 0
+                response = ydl.urlopen(Request(fmt['url'], headers=headers))
+                try:
+                    while True:
+                        block = response.read(block_size)
+                        if not block:
+                            break
+                        received += len(block)
+                        yield block
+                    partial_content = response.status == 206
+                finally:
+                    response.close()
+                
+                start += received
+                # Done when the server ignored Range, sent a short chunk, or we reached the size
+                if not partial_content or received < requested or (total and start >= total):
+                    return
+    
+    def _iter_mp3_encode(self, source, bitrate, block_size=65536):
+        """Pipe source bytes through ffmpeg and yield MP3 output as it is produced"""
+        cmd = [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error',
+            '-threads', str(transcoder.threads_per_job),
+            '-i', 'pipe:0',
+            '-vn', '-acodec', 'libmp3lame', '-b:a', f'{bitrate}k',
+            '-f', 'mp3', 'pipe:1'
+        ]
+        
+        with transcoder.pipe(cmd) as process:
+            def feed():
+                try:
+                    for chunk in source:
+                        process.stdin.write(chunk)
+                except Exception as e:
+                    logger.warning(f"Stopped feeding ffmpeg: {str(e)}")
+                finally:
+                    source.close()
+                    try:
+                        process.stdin.close()
+                    except Exception:
+                        pass
+            
+            feeder = threading.Thread(target=feed, daemon=True)
+            feeder.start()
+            while True:
+                block = process.stdout.read(block_size)
+                if not block:
+                    break
+                yield block
+            if process.wait() != 0:
+                raise Exception(f"FFmpeg streaming encode failed: {process.stderr.read().decode(errors='replace')}")
+    
+    def convert_video_to_audio(self, video_path, quality='256kbps', title=None, video_id=None, defer_transcode=False):
+        """Extract the audio track of a video already on disk, without touching the network
+        
+        Returns the same shape as download_audio: native qualities are
+        stream-copied when the video's audio codec allows it, everything else
+        is encoded on the transcode scheduler. The video file is left in place.
+        """
         try:
             if not os.path.exists(video_path):
                 raise Exception("Video file not found")
             
-            base_name = os.path.splitext(os.path.basename(video_path))[0]
-            audio_path = os.path.join(self.downloads_dir, f"{base_name}_audio_{quality}.mp3")
-            
-            bitrate = self.audio_qualities.get(quality, '256')
-            
-            # Use subprocess to call ffmpeg directly for Railway compatibility
-            cmd = [
-                'ffmpeg', '-i', video_path,
-                '-acodec', 'mp3',
-                '-ab', f'{bitrate}k',
-                '-y',  # Overwrite output file
-                audio_path
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode != 0:
-                raise Exception(f"FFmpeg conversion failed: {result.stderr}")
+            base_name = sanitize_filename(title) if title else os.path.splitext(os.path.basename(video_path))[0]
+            ext = quality if quality in self.native_audio_formats else 'mp3'
+            output_dir = job_output_dir(video_id, quality, self.downloads_dir, self.job_key) if video_id else self.downloads_dir
+            audio_path = os.path.join(output_dir, f"{base_name}_{quality}.{ext}")
             
-            return {
-                'audio_path': audio_path,
+            result = {
+                'title': title or base_name,
+                'file_path': audio_path,
+                'format': 'audio',
                 'quality': quality
             }
+            return self._finish_audio(result, video_path, probe_audio_codec(video_path),
+                                      defer_transcode, keep_source=True)
             
         except Exception as e:
             logger.error(f"Video to audio conversion failed: {str(e)}")
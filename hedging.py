@@ -0,0 +1,102 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+class HedgedRunner:
+    """Run fallback attempts with hedging instead of strictly one after another
+
+    The first attempt starts immediately. If it has not answered after delay
+    seconds the next one starts alongside it, up to max_parallel per call; a
+    failure starts the next one straight away, as the sequential loop would.
+    The first success wins and attempts that have not started are cancelled.
+    yt-dlp cannot be interrupted, so attempts already running are abandoned
+    and finish in the background. Hedges (attempts started only because of
+    the delay) are extra upstream load, so at most max_extra of them run at
+    once across the process; beyond that a call just waits.
+    """
+
+    def __init__(self, delay=3.0, max_parallel=2, max_extra=4, enabled=False):
+        self.delay = float(delay)
+        self.max_parallel = max(1, int(max_parallel))
+        self.max_extra = max(0, int(max_extra))
+        self.enabled = enabled
+        self._pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix='hedge')
+        self._extra = threading.BoundedSemaphore(self.max_extra) if self.max_extra else None
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.capped = 0
+
+    def run(self, attempts):
+        """First successful result of the attempt callables, tried in order; raises the last error"""
+        pending = list(enumerate(attempts))
+        running = {}  # future -> (position, is_hedge)
+        last_error = None
+        with self._lock:
+            self.calls += 1
+
+        def launch(hedge=False):
+            position, attempt = pending.pop(0)
+            future = self._pool.submit(attempt)
+            running[future] = (position, hedge)
+            if hedge:
+                with self._lock:
+                    self.hedges += 1
+                future.add_done_callback(lambda f: self._extra.release())
+
+        launch()
+        while running:
+            can_hedge = pending and len(running) < self.max_parallel
+            done, _ = wait(list(running), timeout=self.delay if can_hedge else None, return_when=FIRST_COMPLETED)
+
+            if not done:
+                if self._extra and self._extra.acquire(blocking=False):
+                    logger.info(f"No answer after {self.delay}s, starting attempt {pending[0][0] + 1} in parallel")
+                    launch(hedge=True)
+                else:
+                    with self._lock:
+                        self.capped += 1
+                    # Hedge budget spent: wait for what is already running
+                    done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                position, hedge = running.pop(future)
+                error = future.exception()
+                if error is None:
+                    for other in running:
+                        other.cancel()
+                    if hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result()
+                last_error = error
+                # A failure starts the next attempt straight away, as the sequential loop
+                # would; it replaces the failed one, so it is not a hedge
+                if pending and len(running) < self.max_parallel:
+                    launch()
+
+        raise last_error or Exception("No attempts to run")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'delay': self.delay,
+                'max_parallel': self.max_parallel,
+                'max_extra': self.max_extra,
+                'calls': self.calls,
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins,
+                'capped': self.capped
+            }
+
+extraction_hedger = HedgedRunner(
+    delay=os.environ.get('HEDGE_DELAY_SECONDS', 3),
+    max_parallel=os.environ.get('HEDGE_MAX_PARALLEL', 2),
+    max_extra=os.environ.get('HEDGE_MAX_EXTRA', 4),
+    enabled=os.environ.get('HEDGED_EXTRACTION', '').lower() in ('1', 'true', 'yes')
+)
@@ -0,0 +1,128 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from cache import metadata_cache
+from downloader import YouTubeDownloader
+from utils import extract_video_id
+
+logger = logging.getLogger(__name__)
+
+class InfoServiceBusy(Exception):
+    """Raised when max_pending lookups are already running or waiting"""
+
+class InfoService:
+    """Metadata lookups run off the request thread
+
+    Extractions run on a bounded pool of max_workers threads, and identical
+    lookups share one extraction. A request waits only briefly (about a
+    second, far less than an extraction takes) and then gets a pending answer
+    and polls, while the extraction finishes in the background and fills the
+    metadata cache. YouTube round trips therefore hold a pool thread, not a
+    request thread, and at most max_pending of them are accepted at once.
+    """
+
+    def __init__(self, max_workers=4, max_pending=64, default_wait=1.0, max_wait=2.0, error_ttl=30.0):
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = max(1, int(max_pending))
+        self.default_wait = float(default_wait)
+        self.max_wait = float(max_wait)
+        self.error_ttl = float(error_ttl)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='info')
+        self._inflight = {}   # video_id -> Future
+        self._failures = {}   # video_id -> (expires_at, error), so polling clients see the error
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.rejected = 0
+
+    def is_known(self, url):
+        """True when a lookup would be answered without a new extraction"""
+        video_id = extract_video_id(url) or url
+        with self._lock:
+            failure = self._failures.get(video_id)
+            if video_id in self._inflight or (failure and failure[0] > time.monotonic()):
+                return True
+        # Not get(): this probe must not count as a cache lookup. Entries only in
+        # the persistent table read as unknown, so at worst a hit is charged.
+        return metadata_cache.contains(video_id)
+
+    def lookup(self, url, app, timeout=None):
+        """Video info, or None if it isn't ready within timeout seconds
+
+        Raises the extraction error, or InfoServiceBusy when the pool is full.
+        """
+        timeout = self.default_wait if timeout is None else min(max(0.0, float(timeout)), self.max_wait)
+        video_id = extract_video_id(url) or url
+        cached = metadata_cache.get(video_id)
+        if cached:
+            return cached
+
+        with self._lock:
+            failure = self._failures.get(video_id)
+            if failure and failure[0] > time.monotonic():
+                raise failure[1]
+            self._failures.pop(video_id, None)
+
+            future = self._inflight.get(video_id)
+            started = future is None
+            if started:
+                if len(self._inflight) >= self.max_pending:
+                    self.rejected += 1
+                    raise InfoServiceBusy(f'{len(self._inflight)} metadata lookups already pending')
+                future = self._pool.submit(self._extract, url, app)
+                self._inflight[video_id] = future
+        if started:
+            # Outside the lock: the callback runs right here if the future already finished
+            future.add_done_callback(lambda f: self._finished(video_id, f))
+
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'pending': len(self._inflight),
+                'max_pending': self.max_pending,
+                'default_wait': self.default_wait,
+                'completed': self.completed,
+                'failed': self.failed,
+                'timeouts': self.timeouts,
+                'rejected': self.rejected
+            }
+
+    def _extract(self, url, app):
+        # App context so the metadata cache can use its persistent table
+        with app.app_context():
+            # lookup() has just missed the cache; checking again would count a second miss
+            return YouTubeDownloader().get_video_info(url, use_cache=False)
+
+    def _finished(self, video_id, future):
+        error = future.exception()
+        with self._lock:
+            self._inflight.pop(video_id, None)
+            if error:
+                self.failed += 1
+                self._failures[video_id] = (time.monotonic() + self.error_ttl, error)
+                # Drop expired failures so the dict stays small
+                now = time.monotonic()
+                for key in [k for k, (expires_at, _) in self._failures.items() if expires_at <= now]:
+                    del self._failures[key]
+            else:
+                self.completed += 1
+        if error:
+            logger.warning(f"Metadata lookup failed for {video_id}: {str(error)}")
+
+info_service = InfoService(
+    max_workers=os.environ.get('INFO_WORKERS', 4),
+    max_pending=os.environ.get('INFO_MAX_PENDING', 64),
+    default_wait=os.environ.get('INFO_WAIT_SECONDS', 1),
+    max_wait=os.environ.get('INFO_MAX_WAIT_SECONDS', 2)
+)
@@ -0,0 +1,224 @@
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_, func
+from app import db
+from models import DownloadHistory
+
+logger = logging.getLogger(__name__)
+
+class DownloadExecutor:
+    """Fixed-size pool of download workers claiming jobs from the DownloadHistory table
+
+    Pending rows are the queue (FIFO by id). A worker claims a row by setting
+    claimed_by and a lease; a heartbeat keeps the lease alive while the job
+    runs. Rows whose lease expired (worker crashed or restarted) become
+    claimable again, so jobs survive restarts and several processes can
+    share one queue.
+    """
+
+    def __init__(self, max_workers=2, lease_seconds=120, poll_interval=2.0, max_attempts=3):
+        self.max_workers = max(1, int(max_workers))
+        self.lease_seconds = int(lease_seconds)
+        self.poll_interval = float(poll_interval)
+        self.max_attempts = int(max_attempts)
+        self.worker_id = None
+        self._app = None
+        self._handler = None
+        self._active = set()
+        self._detached = set()
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def init_app(self, app, handler):
+        """Register the Flask app and the job handler(download_id, url, format_type, quality)"""
+        self._app = app
+        self._handler = handler
+
+    def start(self):
+        """Start worker and heartbeat threads once per process (after gunicorn has forked)"""
+        with self._cond:
+            if self._threads:
+                return
+            self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+            for i in range(self.max_workers):
+                thread = threading.Thread(target=self._worker, name=f"download-worker-{i+1}")
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+            heartbeat = threading.Thread(target=self._heartbeat, name="download-heartbeat")
+            heartbeat.daemon = True
+            heartbeat.start()
+            self._threads.append(heartbeat)
+        logger.info(f"Started {self.max_workers} download workers as {self.worker_id}")
+
+    def run_forever(self):
+        """Run workers in the foreground (standalone worker process)"""
+        self.start()
+        while True:
+            time.sleep(3600)
+
+    def notify(self):
+        """Wake idle workers in this process after new jobs were inserted"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def detach(self, job_id):
+        """Hand a running job to another stage: its worker slot is freed but the lease is kept alive"""
+        with self._cond:
+            self._detached.add(job_id)
+
+    def release(self, job_id):
+        """Stop heartbeating a detached job once it has been finished"""
+        with self._cond:
+            self._detached.discard(job_id)
+            self._cond.notify_all()
+
+    def _claimable(self, now):
+        return and_(
+            DownloadHistory.status == 'pending',
+            or_(DownloadHistory.claimed_by.is_(None), DownloadHistory.lease_expires_at < now)
+        )
+
+    def position(self, job_id):
+        """1-based position in the queue, 0 if running, None if not queued"""
+        now = datetime.utcnow()
+        record = db.session.query(
+            DownloadHistory.status, DownloadHistory.claimed_by, DownloadHistory.lease_expires_at
+        ).filter(DownloadHistory.id == job_id).first()
+        if not record or record.status != 'pending':
+            return None
+        if record.claimed_by and record.lease_expires_at and record.lease_expires_at >= now:
+            return 0
+        return db.session.query(func.count(DownloadHistory.id)).filter(
+            self._claimable(now), DownloadHistory.id <= job_id).scalar()
+
+    def wait(self, job_id, timeout=None):
+        """Block until a job leaves 'pending' (in any process); False on timeout"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            status = db.session.query(DownloadHistory.status).filter(DownloadHistory.id == job_id).scalar()
+            db.session.commit()  # end the read transaction so the next check sees new data
+            if status != 'pending':
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            with self._cond:
+                # Local workers notify on completion; other processes are picked up by polling
+                self._cond.wait(0.5)
+
+    def queue_depth(self):
+        return db.session.query(func.count(DownloadHistory.id)).filter(
+            self._claimable(datetime.utcnow())).scalar()
+
+    def stats(self):
+        now = datetime.utcnow()
+        running = db.session.query(func.count(DownloadHistory.id)).filter(
+            DownloadHistory.status == 'pending',
+            DownloadHistory.claimed_by.isnot(None),
+            DownloadHistory.lease_expires_at >= now
+        ).scalar()
+        with self._cond:
+            local_active = len(self._active)
+            local_detached = len(self._detached)
+        return {
+            'queue_depth': self.queue_depth(),
+            'active': running,
+            'local_active': local_active,
+            'local_detached': local_detached,
+            'max_workers': self.max_workers
+        }
+
+    def _claim_next(self):
+        """Atomically claim the oldest claimable job; returns its fields or None"""
+        for _ in range(5):
+            now = datetime.utcnow()
+            candidate = DownloadHistory.query.filter(self._claimable(now)).order_by(
+                DownloadHistory.id).with_for_update(skip_locked=True).first()
+            if not candidate:
+                db.session.rollback()
+                return None
+
+            job = (candidate.id, candidate.url, candidate.format_type, candidate.quality)
+            if (candidate.attempts or 0) >= self.max_attempts:
+                candidate.status = 'failed'
+                candidate.error_message = f'Download abandoned after {candidate.attempts} attempts'
+                candidate.completed_at = now
+                candidate.lease_expires_at = None
+                db.session.commit()
+                logger.warning(f"Giving up on download {job[0]} after {self.max_attempts} attempts")
+                continue
+
+            # Conditional update: only one worker wins even without row locks (SQLite)
+            claimed = DownloadHistory.query.filter(
+                DownloadHistory.id == candidate.id, self._claimable(now)
+            ).update({
+                DownloadHistory.claimed_by: self.worker_id,
+                DownloadHistory.heartbeat_at: now,
+                DownloadHistory.lease_expires_at: now + timedelta(seconds=self.lease_seconds),
+                DownloadHistory.attempts: func.coalesce(DownloadHistory.attempts, 0) + 1
+            }, synchronize_session=False)
+            db.session.commit()
+            if claimed:
+                return job
+        return None
+
+    def _worker(self):
+        while True:
+            try:
+                with self._app.app_context():
+                    job = self._claim_next()
+            except Exception as e:
+                logger.error(f"Failed to claim download job: {str(e)}")
+                job = None
+
+            if job is None:
+                with self._cond:
+                    self._cond.wait(self.poll_interval)
+                continue
+
+            job_id = job[0]
+            with self._cond:
+                self._active.add(job_id)
+            try:
+                self._handler(*job)
+            except Exception as e:
+                logger.error(f"Download job {job_id} crashed: {str(e)}")
+            finally:
+                with self._cond:
+                    self._active.discard(job_id)
+                    self._cond.notify_all()
+
+    def _heartbeat(self):
+        """Extend leases of jobs running (or detached) in this process"""
+        interval = max(1, self.lease_seconds // 3)
+        while True:
+            time.sleep(interval)
+            with self._cond:
+                active = list(self._active | self._detached)
+            if not active:
+                continue
+            try:
+                with self._app.app_context():
+                    now = datetime.utcnow()
+                    DownloadHistory.query.filter(
+                        DownloadHistory.id.in_(active),
+                        DownloadHistory.claimed_by == self.worker_id
+                    ).update({
+                        DownloadHistory.heartbeat_at: now,
+                        DownloadHistory.lease_expires_at: now + timedelta(seconds=self.lease_seconds)
+                    }, synchronize_session=False)
+                    db.session.commit()
+            except Exception as e:
+                logger.error(f"Download heartbeat failed: {str(e)}")
+
+executor = DownloadExecutor(
+    max_workers=os.environ.get('MAX_CONCURRENT_DOWNLOADS', 2),
+    lease_seconds=os.environ.get('JOB_LEASE_SECONDS', 120),
+    poll_interval=os.environ.get('JOB_POLL_INTERVAL', 2.0),
+    max_attempts=os.environ.get('JOB_MAX_ATTEMPTS', 3)
+)
@@ -0,0 +1,145 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Seconds; stages range from sub-second serves to multi-minute downloads
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(key)} {value}')
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            data = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, data in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, data):
+                    lines.append(f'{self.name}_bucket{_format_labels(key + (("le", bound),))} {count}')
+                lines.append(f'{self.name}_bucket{_format_labels(key + (("le", "+Inf"),))} {data[-1]}')
+                lines.append(f'{self.name}_sum{_format_labels(key)} {data[-2]}')
+                lines.append(f'{self.name}_count{_format_labels(key)} {data[-1]}')
+        return lines
+
+class MetricsRegistry:
+    """Process-local metrics rendered in the Prometheus text format
+
+    Counters and histograms are updated where the work happens; gauges are
+    collected from the existing stats() methods at scrape time.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help_text):
+        metric = Counter(name, help_text)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        """Register fn() -> iterable of (name, type, help, [(labels dict, value), ...])"""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for fn in self._collectors:
+            try:
+                samples = list(fn())
+            except Exception as e:
+                logger.warning(f"Metrics collector {fn.__name__} failed: {str(e)}")
+                continue
+            for name, metric_type, help_text, values in samples:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for labels, value in values:
+                    if value is not None:
+                        lines.append(f'{name}{_format_labels(tuple(sorted(labels.items())))} {value}')
+        return '\n'.join(lines) + '\n'
+
+def classify_error(message):
+    """Coarse error class for failure counters"""
+    message = str(message)
+    if '403' in message or 'Forbidden' in message or 'blocked' in message:
+        return 'forbidden'
+    if 'Sign in' in message or 'sign-in' in message:
+        return 'sign_in_required'
+    if 'unavailable' in message.lower() or 'private' in message.lower():
+        return 'unavailable'
+    if 'timed out' in message.lower() or 'timeout' in message.lower():
+        return 'timeout'
+    if 'TransportError' in message or 'Connection' in message or 'Name or service not known' in message:
+        return 'network'
+    if 'ffmpeg' in message.lower() or 'conversion' in message.lower() or 'remux' in message.lower():
+        return 'postprocessing'
+    return 'other'
+
+registry = MetricsRegistry()
+
+stage_seconds = registry.histogram(
+    'ytdl_stage_duration_seconds', 'Time spent per pipeline stage (extract, download, transcode, remux, serve)')
+method_attempts = registry.counter(
+    'ytdl_method_attempts_total', 'Extraction and download fallback method attempts by outcome')
+errors_total = registry.counter(
+    'ytdl_errors_total', 'Failed operations by error class')
+bytes_total = registry.counter(
+    'ytdl_bytes_total', 'Bytes downloaded from upstream and served to clients')
+submissions_total = registry.counter(
+    'ytdl_download_submissions_total', 'Download submissions, queued as new jobs or reused from identical ones')
@@ -0,0 +1,14 @@
+"""Database schema setup: python migrate.py
+
+Creates missing tables and applies upgrade_schema(). Run it as a pre-deploy
+step so web processes can start with SCHEMA_SETUP_ON_BOOT=0.
+"""
+import os
+
+os.environ['SCHEMA_SETUP_ON_BOOT'] = '0'  # run it once below, not again on import
+
+from app import app  # noqa: E402
+import startup  # noqa: E402
+
+if __name__ == '__main__':
+    startup.init_database(app)
@@ -1,9 +1,27 @@
+import logging
 from app import db
 from datetime import datetime
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
 
 class DownloadHistory(db.Model):
+    __table_args__ = (
+        db.Index('ix_download_history_dedup', 'video_id', 'format_type', 'quality'),
+        # At most one queued or running job per video/format/quality, across all processes
+        db.Index('ux_download_history_pending', 'video_id', 'format_type', 'quality', unique=True,
+                 sqlite_where=text("status = 'pending'"), postgresql_where=text("status = 'pending'")),
+        db.Index('ix_download_history_queue', 'status', 'id'),
+        db.Index('ix_download_history_created', 'created_at', 'id'),
+        db.Index('ix_download_history_status_created', 'status', 'created_at', 'id'),
+        db.Index('ix_download_history_format_created', 'format_type', 'created_at', 'id'),
+        db.Index('ix_download_history_url', 'url'),
+        db.Index('ix_download_history_file_path', 'file_path'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     url = db.Column(db.String(500), nullable=False)
+    video_id = db.Column(db.String(32), nullable=True)
     title = db.Column(db.String(200), nullable=True)
     format_type = db.Column(db.String(20), nullable=False)  # 'video' or 'audio'
     quality = db.Column(db.String(20), nullable=False)
@@ -12,11 +30,19 @@ class DownloadHistory(db.Model):
     error_message = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     completed_at = db.Column(db.DateTime, nullable=True)
+    processing = db.Column(db.String(20), nullable=True)  # audio only: 'stream_copy' or 'transcode'
+    
+    # Job queue bookkeeping (see jobs.DownloadExecutor)
+    claimed_by = db.Column(db.String(100), nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    attempts = db.Column(db.Integer, nullable=True)
     
     def to_dict(self):
         return {
             'id': self.id,
             'url': self.url,
+            'video_id': self.video_id,
             'title': self.title,
             'format_type': self.format_type,
             'quality': self.quality,
@@ -25,5 +51,65 @@ class DownloadHistory(db.Model):
             'error_message': self.error_message,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'completed_at': self.completed_at.isoformat() if self.completed_at else None,
+            'processing': self.processing,
             'download_url': f'/api/download/{self.id}/file' if self.status == 'completed' else None
         }
+    
+    # Columns needed by to_summary_dict, for load_only() in list queries
+    SUMMARY_COLUMNS = ('id', 'video_id', 'title', 'format_type', 'quality', 'status', 'created_at', 'completed_at')
+    
+    def to_summary_dict(self):
+        """Lean representation for history listings"""
+        return {
+            'id': self.id,
+            'video_id': self.video_id,
+            'title': self.title,
+            'format_type': self.format_type,
+            'quality': self.quality,
+            'status': self.status,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
+            'download_url': f'/api/download/{self.id}/file' if self.status == 'completed' else None
+        }
+
+class DownloadBatch(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    source_url = db.Column(db.String(500), nullable=True)  # playlist URL when expanded from one
+    format_type = db.Column(db.String(20), nullable=False)
+    quality = db.Column(db.String(20), nullable=False)
+    download_ids = db.Column(db.Text, nullable=False, default='[]')  # JSON list in submission order
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class CachedFile(db.Model):
+    path = db.Column(db.String(500), primary_key=True)
+    size_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    access_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_accessed_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class VideoInfoCache(db.Model):
+    video_id = db.Column(db.String(32), primary_key=True)
+    info = db.Column(db.Text, nullable=False)  # JSON-encoded get_video_info() result
+    fetched_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+def upgrade_schema():
+    """Add columns and indexes introduced after a table was first created"""
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+        
+        for index in table.indexes:
+            try:
+                index.create(db.engine, checkfirst=True)
+            except Exception as e:
+                # e.g. a unique index over rows that already hold duplicates
+                logger.error(f"Failed to create index {index.name}: {str(e)}")
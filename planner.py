@@ -0,0 +1,122 @@
+import os
+from utils import get_video_format_info
+
+# Video codec families the planner may pick, most preferred first. AV1 is the
+# smallest but not every player handles it, so it has to be opted into.
+VIDEO_CODEC_ALIASES = {'avc1': ('avc1', 'h264'), 'vp9': ('vp9', 'vp09'), 'av01': ('av01',)}
+VIDEO_CODECS = [c.strip() for c in os.environ.get('FORMAT_VIDEO_CODECS', 'avc1,vp9').split(',') if c.strip()]
+VIDEO_CODEC_RANK = tuple((alias, i) for i, family in enumerate(VIDEO_CODECS)
+                         for alias in VIDEO_CODEC_ALIASES.get(family, (family,)))
+AUDIO_CODEC_RANK = (('mp4a', 0), ('aac', 0), ('opus', 1))
+
+# Audio paired with video-only streams should not drop below this bitrate
+MIN_VIDEO_AUDIO_ABR = 96
+
+def _codec_rank(codec, ranks):
+    for prefix, rank in ranks:
+        if (codec or '').startswith(prefix):
+            return rank
+    return len(ranks)
+
+def _has_video(f):
+    return f.get('vcodec') not in (None, 'none')
+
+def _has_audio(f):
+    return f.get('acodec') not in (None, 'none')
+
+def _size_key(expected_bytes):
+    # Unknown sizes rank after every known one
+    return (expected_bytes is None, expected_bytes or 0)
+
+def _video_plan(video, audio=None):
+    if audio is None:
+        expected = video['expected_bytes']
+    elif video['expected_bytes'] is not None and audio['expected_bytes'] is not None:
+        expected = video['expected_bytes'] + audio['expected_bytes']
+    else:
+        expected = None
+    return {
+        'format': f"{video['format_id']}+{audio['format_id']}" if audio else video['format_id'],
+        'merge': audio is not None,
+        'expected_bytes': expected,
+        'height': video['height'],
+        'fps': video['fps'],
+        'vcodec': video['vcodec'],
+        'acodec': audio['acodec'] if audio else video['acodec'],
+        'ext': 'mp4' if audio else video['ext']
+    }
+
+def _pairing_audio(formats):
+    """Smallest audio-only stream that is still good enough to sit next to video"""
+    audio_only = [f for f in formats if _has_audio(f) and not _has_video(f)]
+    if not audio_only:
+        return None
+    good = [f for f in audio_only if (f['abr'] or f['tbr'] or 0) >= MIN_VIDEO_AUDIO_ABR]
+    if not good:
+        return max(audio_only, key=lambda f: f['abr'] or f['tbr'] or 0)
+    return min(good, key=lambda f: (_size_key(f['expected_bytes']), _codec_rank(f['acodec'], AUDIO_CODEC_RANK)))
+
+def rank_video_formats(info_dict, max_height, smallest=False):
+    """Candidate video plans, best first
+
+    Progressive formats and DASH video+audio pairs up to max_height compete
+    on equal terms. Codecs outside FORMAT_VIDEO_CODECS are dropped unless
+    nothing else is left. Only the tallest available height is kept (unless
+    smallest is set, where any height qualifies), then candidates are ordered
+    by expected bytes, no-merge before merge, and codec preference.
+    """
+    formats = get_video_format_info(info_dict)
+    audio = _pairing_audio(formats)
+    plans = []
+    for f in formats:
+        if not _has_video(f) or not f['height'] or f['height'] > max_height:
+            continue
+        if _has_audio(f):
+            plans.append(_video_plan(f))
+        elif audio:
+            plans.append(_video_plan(f, audio))
+
+    allowed = [plan for plan in plans if _codec_rank(plan['vcodec'], VIDEO_CODEC_RANK) < len(VIDEO_CODEC_RANK)]
+    plans = allowed or plans
+
+    if plans and not smallest:
+        best_height = max(plan['height'] for plan in plans)
+        plans = [plan for plan in plans if plan['height'] == best_height]
+
+    plans.sort(key=lambda plan: (_size_key(plan['expected_bytes']), plan['merge'],
+                                 _codec_rank(plan['vcodec'], VIDEO_CODEC_RANK)))
+    return plans
+
+def rank_audio_formats(info_dict, min_abr=None, codecs=None):
+    """Candidate audio-only plans, best first
+
+    With codecs (native containers) the best stream of that codec wins, since
+    it is kept as-is. Otherwise the audio is re-encoded at min_abr, so the
+    smallest stream at or above that bitrate wins and anything larger would
+    only be wasted transfer.
+    """
+    formats = [f for f in get_video_format_info(info_dict) if _has_audio(f) and not _has_video(f)]
+    if codecs:
+        formats = [f for f in formats if (f['acodec'] or '').startswith(codecs)]
+
+    def abr(f):
+        return f['abr'] or f['tbr'] or 0
+
+    def rank(f):
+        if codecs or not min_abr:
+            return (0, -abr(f))
+        if abr(f) >= min_abr:
+            return (0, _size_key(f['expected_bytes']), _codec_rank(f['acodec'], AUDIO_CODEC_RANK))
+        # Nothing reaches the target: closest below it first
+        return (1, -abr(f))
+
+    formats.sort(key=rank)
+
+    return [{
+        'format': f['format_id'],
+        'merge': False,
+        'expected_bytes': f['expected_bytes'],
+        'abr': abr(f) or None,
+        'acodec': f['acodec'],
+        'ext': f['ext']
+    } for f in formats]
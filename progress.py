@@ -0,0 +1,112 @@
+import os
+import time
+import queue
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STAGES = ('completed', 'failed')
+
+class ProgressBus:
+    """In-memory fan-out of download progress events to SSE subscribers
+
+    Each open SSE stream holds a request thread, so at most max_streams of
+    them are open per process; the rest are refused and clients poll.
+    """
+
+    def __init__(self, max_tracked=1000, min_interval=0.5, max_streams=4):
+        self.max_tracked = max_tracked
+        self.min_interval = min_interval  # seconds between byte-progress events per download
+        self.max_streams = max(0, int(max_streams))
+        self._streams = 0
+        self.streams_rejected = 0
+        self._latest = OrderedDict()  # download_id -> last event
+        self._last_sent = {}
+        self._subscribers = {}  # download_id -> set of queue.Queue
+        self._lock = threading.Lock()
+
+    def publish(self, download_id, stage, **fields):
+        """Record and broadcast an event; rapid byte updates are throttled"""
+        now = time.monotonic()
+        event = {'download_id': download_id, 'stage': stage, **fields}
+
+        with self._lock:
+            previous = self._latest.get(download_id)
+            same_stage = previous is not None and previous.get('stage') == stage
+            if same_stage and stage == 'downloading' and now - self._last_sent.get(download_id, 0) < self.min_interval:
+                self._latest[download_id] = event
+                return
+
+            self._latest[download_id] = event
+            self._latest.move_to_end(download_id)
+            self._last_sent[download_id] = now
+            while len(self._latest) > self.max_tracked:
+                old_id, _ = self._latest.popitem(last=False)
+                self._last_sent.pop(old_id, None)
+
+            subscribers = list(self._subscribers.get(download_id, ()))
+
+        for subscriber in subscribers:
+            subscriber.put(event)
+
+    def latest(self, download_id):
+        with self._lock:
+            return self._latest.get(download_id)
+
+    def subscribe(self, download_ids):
+        subscriber = queue.Queue()
+        with self._lock:
+            for download_id in download_ids:
+                self._subscribers.setdefault(download_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, download_ids, subscriber):
+        with self._lock:
+            for download_id in download_ids:
+                subscribers = self._subscribers.get(download_id)
+                if subscribers:
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del self._subscribers[download_id]
+
+    def open_stream(self):
+        """Reserve one of max_streams stream slots; False when all are taken"""
+        with self._lock:
+            if self._streams >= self.max_streams:
+                self.streams_rejected += 1
+                return False
+            self._streams += 1
+            return True
+
+    def close_stream(self):
+        with self._lock:
+            self._streams -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tracked_downloads': len(self._latest),
+                'subscribers': sum(len(s) for s in self._subscribers.values()),
+                'open_streams': self._streams,
+                'max_streams': self.max_streams,
+                'streams_rejected': self.streams_rejected
+            }
+
+def progress_hook_event(d):
+    """Convert a yt-dlp progress hook dict into progress bus fields"""
+    total = d.get('total_bytes') or d.get('total_bytes_estimate')
+    downloaded = d.get('downloaded_bytes')
+    percent = round(downloaded * 100.0 / total, 1) if total and downloaded is not None else None
+    return {
+        'downloaded_bytes': downloaded,
+        'total_bytes': total,
+        'percent': percent,
+        'speed': d.get('speed'),
+        'eta': d.get('eta'),
+        'fragment_index': d.get('fragment_index'),
+        'fragment_count': d.get('fragment_count')
+    }
+
+progress_bus = ProgressBus(max_streams=os.environ.get('SSE_MAX_STREAMS', 4))
@@ -0,0 +1,108 @@
+import os
+import math
+import time
+import logging
+import threading
+from functools import wraps
+from collections import OrderedDict
+from flask import request, jsonify
+
+logger = logging.getLogger(__name__)
+
+class RateLimiter:
+    """Per-client token buckets, one set per named budget
+
+    A client is an API key from RATE_LIMIT_API_KEYS (sent as X-API-Key) or
+    otherwise the remote IP. Each budget refills at per_minute tokens per
+    minute up to burst. Buckets live in process memory, so every gunicorn
+    worker enforces its own copy of the limits.
+    """
+
+    def __init__(self, budgets, api_keys=(), max_clients=10000, enabled=True):
+        self.budgets = dict(budgets)  # name -> (per_minute, burst)
+        self.api_keys = set(api_keys)
+        self.max_clients = max_clients
+        self.enabled = enabled
+        self._buckets = OrderedDict()  # (budget, client) -> [tokens, updated_at]
+        self._rejected = {}
+        self._lock = threading.Lock()
+
+    def client_id(self):
+        api_key = request.headers.get('X-API-Key')
+        if api_key and api_key in self.api_keys:
+            return f'key:{api_key}'
+        return f'ip:{request.remote_addr}'
+
+    def consume(self, budget, client, cost=1):
+        """Take cost tokens; returns 0 on success or the seconds until they are available"""
+        per_minute, burst = self.budgets[budget]
+        rate = per_minute / 60.0
+        now = time.monotonic()
+        key = (budget, client)
+
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0
+            else:
+                wait = (cost - tokens) / rate if rate else 3600
+                self._rejected[budget] = self._rejected.get(budget, 0) + 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def limit(self, budget, cost=None):
+        """Route decorator: reject with 429 once the client's budget is spent
+
+        cost is a callable returning the tokens a request needs (default 1).
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if self.enabled:
+                    wait = self.consume(budget, self.client_id(), cost() if cost else 1)
+                    if wait:
+                        return too_many_requests(f'Rate limit exceeded for {budget} requests', wait)
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'tracked_clients': len({client for _, client in self._buckets}),
+                'budgets': {name: {'per_minute': per_minute, 'burst': burst, 'rejected': self._rejected.get(name, 0)}
+                            for name, (per_minute, burst) in self.budgets.items()}
+            }
+
+def too_many_requests(message, retry_after):
+    """429 response with a Retry-After header (whole seconds, at least 1)"""
+    retry_after = max(1, math.ceil(retry_after))
+    response = jsonify({'error': message, 'retry_after': retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def _budget(name, per_minute, burst):
+    prefix = f'RATE_LIMIT_{name.upper()}'
+    return name, (float(os.environ.get(f'{prefix}_PER_MINUTE', per_minute)),
+                  float(os.environ.get(f'{prefix}_BURST', burst)))
+
+rate_limiter = RateLimiter(
+    budgets=dict([
+        _budget('api', 300, 60),          # every /api/ request
+        _budget('info', 30, 10),          # metadata lookups hitting YouTube
+        _budget('download', 12, 5),       # each queued or streamed download
+        _budget('batch', 2, 2),           # batch/playlist submissions
+        _budget('batch_items', 30, 500),  # URLs accepted in batches, one token each
+    ]),
+    api_keys=[key.strip() for key in os.environ.get('RATE_LIMIT_API_KEYS', '').split(',') if key.strip()],
+    enabled=os.environ.get('RATE_LIMIT_ENABLED', '1') != '0'
+)
+
+# Admission control: stop accepting new jobs once this many are waiting
+MAX_QUEUE_DEPTH = int(os.environ.get('MAX_QUEUE_DEPTH', 200))
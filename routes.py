@@ -1,14 +1,53 @@
 import os
 import logging
-from flask import render_template, request, jsonify, send_file, flash, redirect, url_for
+import json
+import time
+import mimetypes
+import queue
+import uuid
+import base64
+import threading
+from functools import partial
+from urllib.parse import quote
+from werkzeug.utils import secure_filename
+from flask import render_template, request, jsonify, send_file, flash, redirect, url_for, Response, stream_with_context
+import startup
 from app import app, db
-from models import DownloadHistory
+from models import DownloadHistory, DownloadBatch
 from downloader import YouTubeDownloader
-from utils import validate_youtube_url, sanitize_filename
+from jobs import executor
+from cache import metadata_cache
+from info_service import info_service, InfoServiceBusy
+from progress import progress_bus, TERMINAL_STAGES
+from storage import storage_manager
+from transcoder import transcoder
+from tuner import throughput_tuner
+from breaker import method_breaker
+from hedging import extraction_hedger
+from cookie_pool import cookie_pool
+from ratelimit import rate_limiter, too_many_requests, MAX_QUEUE_DEPTH
+from metrics import registry, stage_seconds, errors_total, bytes_total, submissions_total, classify_error
+from utils import validate_youtube_url, sanitize_filename, extract_video_id, extract_playlist_id, job_output_dir
 from datetime import datetime
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import load_only
 
 logger = logging.getLogger(__name__)
 
+# How long requests wait for a deferred schema setup before getting 503
+SCHEMA_WAIT_SECONDS = float(os.environ.get('SCHEMA_WAIT_SECONDS', 30))
+
+# How long GET /api/get/download holds a request thread for the job; keep it below gunicorn --timeout
+DOWNLOAD_WAIT_SECONDS = float(os.environ.get('DOWNLOAD_WAIT_SECONDS', 60))
+
+# Serializes the duplicate lookup and insert between this process's threads
+_submit_lock = threading.Lock()
+
+# Valid quality options
+VIDEO_QUALITIES = ['3gp', '360p', '480p', '720p', '1080p']
+AUDIO_QUALITIES = ['128kbps', '192kbps', '256kbps', '320kbps', 'm4a', 'opus']
+
 @app.route('/health')
 def health_check():
     """Health check endpoint for Railway deployment"""
@@ -18,18 +57,329 @@ def health_check():
         'timestamp': datetime.utcnow().isoformat()
     }), 200
 
+@app.route('/api/stats')
+def service_stats():
+    """Queue and cache statistics"""
+    return jsonify({
+        'queue': executor.stats(),
+        'metadata_cache': metadata_cache.stats(),
+        'progress': progress_bus.stats(),
+        'storage': storage_manager.usage(),
+        'transcode': transcoder.stats(),
+        'throughput': throughput_tuner.stats(),
+        'rate_limit': rate_limiter.stats(),
+        'info_lookups': info_service.stats(),
+        'methods': method_breaker.stats(),
+        'hedging': extraction_hedger.stats(),
+        'cookies': cookie_pool.stats(),
+        'startup': startup.stats()
+    })
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+@registry.collector
+def service_gauges():
+    """Queue, transcoder, cache, storage and limiter state at scrape time"""
+    queue_stats = executor.stats()
+    transcode_stats = transcoder.stats()
+    cache_stats = metadata_cache.stats()
+    storage_stats = storage_manager.usage()
+    yield ('ytdl_queue_depth', 'gauge', 'Jobs waiting for a download worker', [({}, queue_stats['queue_depth'])])
+    yield ('ytdl_jobs_active', 'gauge', 'Jobs currently claimed by a worker (all processes)', [({}, queue_stats['active'])])
+    yield ('ytdl_transcode_jobs', 'gauge', 'Transcode jobs in this process',
+           [({'state': 'running'}, transcode_stats['running']), ({'state': 'queued'}, transcode_stats['queued'])])
+    yield ('ytdl_metadata_cache_lookups_total', 'counter', 'Metadata cache lookups by result',
+           [({'result': 'hit'}, cache_stats['hits']), ({'result': 'persistent_hit'}, cache_stats['persistent_hits']),
+            ({'result': 'miss'}, cache_stats['misses'])])
+    yield ('ytdl_metadata_cache_hit_ratio', 'gauge', 'Share of metadata lookups served from cache', [({}, cache_stats['hit_rate'])])
+    yield ('ytdl_storage_bytes', 'gauge', 'Bytes held in downloads/', [({}, storage_stats['total_bytes'])])
+    yield ('ytdl_storage_files', 'gauge', 'Files held in downloads/', [({}, storage_stats['files'])])
+    yield ('ytdl_info_lookups_pending', 'gauge', 'Metadata extractions running or waiting in this process',
+           [({}, info_service.stats()['pending'])])
+    yield ('ytdl_method_circuit_open', 'gauge', 'Fallback methods currently skipped by their circuit breaker',
+           [({'operation': operation, 'method': method}, int(state['state'] == 'open'))
+            for operation, methods in method_breaker.stats().items() for method, state in methods.items()])
+    yield ('ytdl_startup_seconds', 'gauge', 'Seconds spent in each startup phase of this process',
+           [({'phase': phase[:-len('_seconds')]}, value) for phase, value in startup.timings.items()])
+    yield ('ytdl_rate_limit_rejected_total', 'counter', 'Requests rejected by rate limit budget',
+           [({'budget': name}, budget['rejected']) for name, budget in rate_limiter.stats()['budgets'].items()])
+
 @app.route('/')
 def index():
     """Main page with download interface"""
-    recent_downloads = DownloadHistory.query.order_by(DownloadHistory.created_at.desc()).limit(10).all()
+    recent_downloads = DownloadHistory.query.options(
+        load_only(*[getattr(DownloadHistory, name) for name in DownloadHistory.SUMMARY_COLUMNS + ('file_path',)])
+    ).order_by(DownloadHistory.created_at.desc(), DownloadHistory.id.desc()).limit(10).all()
     return render_template('index.html', recent_downloads=recent_downloads)
 
+def find_existing_downloads(video_ids, format_type, quality):
+    """Map video IDs to in-flight or finished downloads that can serve identical requests"""
+    video_ids = list({video_id for video_id in video_ids if video_id})
+    if not video_ids:
+        return {}
+    
+    candidates = DownloadHistory.query.filter(
+        DownloadHistory.video_id.in_(video_ids),
+        DownloadHistory.format_type == format_type,
+        DownloadHistory.quality == quality,
+        DownloadHistory.status.in_(['pending', 'completed'])
+    ).order_by(DownloadHistory.created_at.desc()).all()
+    
+    existing = {}
+    for record in candidates:
+        if record.video_id in existing:
+            continue
+        # Pending rows are in the durable queue and will run (or be recovered)
+        if record.status == 'pending':
+            existing[record.video_id] = record
+        elif record.status == 'completed' and record.file_path and os.path.exists(record.file_path):
+            existing[record.video_id] = record
+    
+    return existing
+
+def find_existing_download(video_id, format_type, quality):
+    """Find an in-flight or finished download that can serve an identical request"""
+    return find_existing_downloads([video_id], format_type, quality).get(video_id)
+
+def find_cached_video(video_id):
+    """Best finished video download of video_id still on disk, to derive audio from"""
+    if not video_id:
+        return None
+    candidates = DownloadHistory.query.options(
+        load_only(DownloadHistory.id, DownloadHistory.title, DownloadHistory.quality, DownloadHistory.file_path)
+    ).filter(
+        DownloadHistory.video_id == video_id,
+        DownloadHistory.format_type == 'video',
+        DownloadHistory.status == 'completed',
+        DownloadHistory.file_path.isnot(None),
+        DownloadHistory.quality != '3gp'  # 3GP audio is too poor to reuse
+    ).all()
+    candidates = [c for c in candidates if os.path.exists(c.file_path)]
+    if not candidates:
+        return None
+    # Higher resolutions generally carry the better audio track
+    return max(candidates, key=lambda c: int(c.quality.rstrip('p')) if c.quality.rstrip('p').isdigit() else 0)
+
+def insert_downloads(urls, format_type, quality, batch=None):
+    """Look up reusable downloads and insert the missing ones in one transaction
+    
+    Returns (results, new_jobs). Raises IntegrityError if another process
+    queued one of the same downloads after the lookup.
+    """
+    video_ids = [extract_video_id(url) for url in urls]
+    existing = find_existing_downloads(video_ids, format_type, quality)
+    
+    items = []
+    new_records = []
+    for url, video_id in zip(urls, video_ids):
+        record = existing.get(video_id)
+        if record:
+            items.append((url, record, True))
+            continue
+        
+        # Create download history record
+        record = DownloadHistory(
+            url=url,
+            video_id=video_id,
+            format_type=format_type,
+            quality=quality,
+            status='pending'
+        )
+        if video_id:
+            existing[video_id] = record  # later duplicates in this submission attach to it
+        new_records.append(record)
+        items.append((url, record, False))
+    
+    if batch is not None:
+        db.session.add(batch)
+    db.session.add_all(new_records)
+    db.session.flush()
+    
+    # Capture results before commit expires the loaded attributes
+    results = [{
+        'url': url,
+        'download_id': record.id,
+        'status': record.status,
+        'deduplicated': deduplicated
+    } for url, record, deduplicated in items]
+    new_jobs = [(record.id, record.url) for record in new_records]
+    if batch is not None:
+        batch.download_ids = json.dumps([item['download_id'] for item in results])
+    db.session.commit()
+    return results, new_jobs
+
+def submit_downloads(urls, format_type, quality, batch=None):
+    """Queue downloads in one transaction, reusing identical in-flight or finished ones"""
+    # The lock keeps this process's threads from racing each other; the unique
+    # index on pending rows catches races with other processes
+    with _submit_lock:
+        for attempt in range(3):
+            try:
+                results, new_jobs = insert_downloads(urls, format_type, quality, batch)
+                break
+            except IntegrityError:
+                db.session.rollback()
+                if attempt == 2:
+                    raise
+                # Another process queued the same download first: look again and attach to it
+                logger.info(f"Concurrent submission for {format_type} {quality}, retrying lookup")
+    
+    # Rows are the queue; wake local workers (other processes pick them up by polling)
+    if new_jobs:
+        start_embedded_workers()
+        executor.notify()
+    for download_id, url in new_jobs:
+        progress_bus.publish(download_id, 'queued')
+    
+    reused = len(results) - len(new_jobs)
+    submissions_total.inc(len(new_jobs), result='queued')
+    submissions_total.inc(reused, result='reused')
+    if reused:
+        logger.info(f"Reused {reused} existing download(s) for {format_type} {quality}")
+    return results
+
+def submit_download(url, format_type, quality):
+    """Return an existing identical download or queue a new one"""
+    item = submit_downloads([url], format_type, quality)[0]
+    return DownloadHistory.query.get(item['download_id']), item['deduplicated']
+
+def start_embedded_workers():
+    """Run download workers inside web processes unless DOWNLOAD_WORKERS_IN_WEB=0"""
+    if os.environ.get('DOWNLOAD_WORKERS_IN_WEB', '1') != '0':
+        executor.start()
+        storage_manager.start(app)
+
+@app.before_request
+def ensure_workers_started():
+    # Started on the first request rather than at import so threads begin
+    # after gunicorn forks, and queued jobs are recovered after a restart.
+    # Runs in the background so /health answers while the schema is set up.
+    startup.run_deferred(app, start_embedded_workers)
+    if request.path != '/health' and not startup.schema_ready.wait(SCHEMA_WAIT_SECONDS):
+        response = jsonify({'error': 'Service is starting up, please retry', 'retry_after': 5})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+
+@app.before_request
+def limit_api_requests():
+    # Overall per-client budget for the JSON API; heavy endpoints add their own
+    if rate_limiter.enabled and request.path.startswith('/api/'):
+        wait = rate_limiter.consume('api', rate_limiter.client_id())
+        if wait:
+            return too_many_requests('Rate limit exceeded', wait)
+
+def invalid_quality_response(format_type, quality):
+    """400 when quality is not offered for format_type, else None"""
+    if format_type == 'video' and quality not in VIDEO_QUALITIES:
+        return jsonify({'error': f'Invalid video quality. Use: {", ".join(VIDEO_QUALITIES)}'}), 400
+    elif format_type == 'audio' and quality not in AUDIO_QUALITIES:
+        return jsonify({'error': f'Invalid audio quality. Use: {", ".join(AUDIO_QUALITIES)}'}), 400
+    return None
+
+def queue_full_response(new_jobs=1):
+    """429 when accepting new_jobs more would push the queue past MAX_QUEUE_DEPTH, else None"""
+    depth = executor.queue_depth()
+    if depth + new_jobs <= MAX_QUEUE_DEPTH:
+        return None
+    # Rough time for the workers to drain the excess, assuming ~30s per job
+    excess = depth + new_jobs - MAX_QUEUE_DEPTH
+    return too_many_requests('Download queue is full, try again later',
+                             min(600, 30 * excess / executor.max_workers))
+
+def record_download_success(download_id, result):
+    """Mark a job completed and notify progress subscribers"""
+    record = DownloadHistory.query.get(download_id)
+    if record:
+        record.title = result.get('title', 'Unknown')
+        record.file_path = result.get('file_path')
+        record.processing = result.get('processing')
+        record.status = 'completed'
+        record.completed_at = datetime.utcnow()
+        record.lease_expires_at = None
+        db.session.commit()
+    storage_manager.register(result.get('file_path'))
+    progress_bus.publish(download_id, 'completed', title=result.get('title'),
+                         download_url=f'/api/download/{download_id}/file')
+
+def record_download_failure(download_id, url, error):
+    """Mark a job failed and notify progress subscribers"""
+    db.session.rollback()
+    record = DownloadHistory.query.get(download_id)
+    if record:
+        record.status = 'failed'
+        record.error_message = str(error)
+        record.completed_at = datetime.utcnow()
+        record.lease_expires_at = None
+        db.session.commit()
+    progress_bus.publish(download_id, 'failed', error_message=str(error))
+    errors_total.inc(operation='download_job', error_class=classify_error(error))
+    logger.error(f"Background download failed for URL {url}: {str(error)}")
+
+def derive_cached_audio(downloader, download_id, url, quality):
+    """Extract audio from a cached video download instead of fetching it again; None if not possible"""
+    video_id = extract_video_id(url)
+    cached_video = find_cached_video(video_id)
+    if not cached_video:
+        return None
+    try:
+        logger.info(f"Deriving audio for download {download_id} from cached video {cached_video.id}")
+        storage_manager.touch(cached_video.file_path)
+        return downloader.convert_video_to_audio(cached_video.file_path, quality, cached_video.title,
+                                                 video_id, defer_transcode=True)
+    except Exception as e:
+        logger.warning(f"Could not derive audio from cached video {cached_video.id}: {str(e)}")
+        return None
+
+def run_download_job(download_id, url, format_type, quality):
+    """Run a claimed download and record the result"""
+    with app.app_context():
+        try:
+            progress_bus.publish(download_id, 'resolving')
+            # A fresh key per claim: a re-claimed job never writes over a run that is still going
+            downloader = YouTubeDownloader(progress_callback=partial(progress_bus.publish, download_id),
+                                           job_key=f"{download_id}-{uuid.uuid4().hex[:8]}")
+            
+            # Download the content; audio comes from a video we already hold when possible
+            if format_type == 'video':
+                result = downloader.download_video(url, quality)
+            else:
+                result = (derive_cached_audio(downloader, download_id, url, quality)
+                          or downloader.download_audio(url, quality, defer_transcode=True))
+            
+            transcode = result.pop('transcode', None)
+            if transcode:
+                # Encoding is CPU-bound: free the download worker and finish from the transcode stage
+                executor.detach(download_id)
+                downloader.transcode_audio(**transcode, callback=partial(finish_transcode_job, download_id, url, result))
+                return
+            
+            record_download_success(download_id, result)
+            
+        except Exception as e:
+            executor.release(download_id)
+            record_download_failure(download_id, url, e)
+
+def finish_transcode_job(download_id, url, result, error):
+    """Transcode stage callback for jobs handed off by run_download_job"""
+    with app.app_context():
+        try:
+            if error:
+                record_download_failure(download_id, url, Exception(f"Audio conversion failed: {str(error)}"))
+            else:
+                record_download_success(download_id, result)
+        finally:
+            executor.release(download_id)
+
+executor.init_app(app, run_download_job)
+
 @app.route('/api/download', methods=['POST'])
+@rate_limiter.limit('download')
 def api_download():
     """API endpoint for downloading videos/audio"""
-    import threading
-    import time
-    
     try:
         data = request.get_json()
         url = data.get('url')
@@ -46,68 +396,203 @@ def api_download():
         if format_type not in ['video', 'audio']:
             return jsonify({'error': 'Invalid format type'}), 400
             
-        # Create download history record
-        download_record = DownloadHistory(
-            url=url,
-            format_type=format_type,
-            quality=quality,
-            status='pending'
-        )
-        db.session.add(download_record)
-        db.session.commit()
+        rejected = queue_full_response()
+        if rejected:
+            return rejected
+        
+        # Attach to an identical in-flight or finished download when possible
+        download_record, deduplicated = submit_download(url, format_type, quality)
         
         # Return download ID immediately for async processing
         download_id = download_record.id
         
-        # Start download in background thread
-        def background_download():
-            from app import app
-            with app.app_context():
-                try:
-                    downloader = YouTubeDownloader()
-                    
-                    # Download the content
-                    if format_type == 'video':
-                        result = downloader.download_video(url, quality)
-                    else:
-                        result = downloader.download_audio(url, quality)
-                    
-                    # Update download record
-                    record = DownloadHistory.query.get(download_id)
-                    if record:
-                        record.title = result.get('title', 'Unknown')
-                        record.file_path = result.get('file_path')
-                        record.status = 'completed'
-                        record.completed_at = datetime.utcnow()
-                        db.session.commit()
-                    
-                except Exception as e:
-                    # Update download record with error
-                    record = DownloadHistory.query.get(download_id)
-                    if record:
-                        record.status = 'failed'
-                        record.error_message = str(e)
-                        record.completed_at = datetime.utcnow()
-                        db.session.commit()
-                    logger.error(f"Background download failed for URL {url}: {str(e)}")
-        
-        # Start background thread
-        thread = threading.Thread(target=background_download)
-        thread.daemon = True
-        thread.start()
-        
         return jsonify({
             'success': True,
             'download_id': download_id,
-            'status': 'pending',
+            'status': download_record.status,
+            'deduplicated': deduplicated,
+            'queue_position': executor.position(download_id),
             'status_url': f'/api/download/{download_id}/status',
-            'message': 'Download started. Use status_url to check progress.'
+            'message': 'Download already available.' if download_record.status == 'completed'
+                       else 'Download queued. Use status_url to check progress.'
         })
             
     except Exception as e:
         logger.error(f"API download error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+def file_etag(file_path):
+    """Strong ETag from file identity (inode, size, modification time)"""
+    stat = os.stat(file_path)
+    return f"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+def metered_response(response, started, served_bytes=None):
+    """Record serve time and bytes once the response has been fully sent"""
+    def on_close():
+        stage_seconds.observe(time.monotonic() - started, stage='serve')
+        size = served_bytes() if served_bytes else response.content_length
+        if size:
+            bytes_total.inc(size, direction='served')
+    if response.direct_passthrough:
+        # File responses skip close callbacks so the server can sendfile() them; record now
+        on_close()
+    else:
+        response.call_on_close(on_close)
+    return response
+
+def serve_download_file(file_path):
+    """Send a downloaded file with Range/ETag support, or hand it to a fronting proxy"""
+    started = time.monotonic()
+    storage_manager.touch(file_path)
+    etag = file_etag(file_path)
+    download_name = os.path.basename(file_path)
+    offload_mode = os.environ.get('FILE_OFFLOAD_MODE', '').lower()
+    
+    if offload_mode in ('x-accel-redirect', 'x-sendfile'):
+        # The proxy streams the bytes (and handles Range); we only answer conditionals
+        mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+        response = Response(mimetype=mimetype)
+        if offload_mode == 'x-accel-redirect':
+            prefix = os.environ.get('X_ACCEL_REDIRECT_PREFIX', '/protected-downloads/')
+            relative_path = os.path.relpath(os.path.abspath(file_path), os.path.abspath('downloads'))
+            response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(relative_path)
+        else:
+            response.headers['X-Sendfile'] = os.path.abspath(file_path)
+        response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(download_name)}"
+        response.set_etag(etag)
+        response = response.make_conditional(request)
+        # The proxy sends the whole file unless it answers a Range itself
+        return metered_response(response, started,
+                                lambda: os.path.getsize(file_path) if response.status_code == 200 else 0)
+    
+    # send_file answers Range (206), If-Range, If-None-Match and If-Modified-Since
+    return metered_response(send_file(
+        file_path,
+        as_attachment=True,
+        download_name=download_name,
+        conditional=True,
+        etag=etag
+    ), started)
+
+@app.route('/api/batch', methods=['POST'])
+@rate_limiter.limit('batch')
+def api_batch():
+    """Queue many downloads (a list of URLs or a playlist) in one request"""
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'A JSON object body is required'}), 400
+        
+        urls = data.get('urls') or []
+        playlist_url = data.get('playlist_url')
+        format_type = data.get('format', 'video')  # 'video' or 'audio'
+        quality = data.get('quality', '720p' if format_type == 'video' else '256kbps')
+        # A larger batch could never be paid for from the batch_items budget
+        max_items = min(int(os.environ.get('BATCH_MAX_ITEMS', 500)), int(rate_limiter.budgets['batch_items'][1]))
+        
+        # Validate inputs
+        if format_type not in ['video', 'audio']:
+            return jsonify({'error': 'Invalid format type'}), 400
+        
+        rejected = invalid_quality_response(format_type, quality)
+        if rejected:
+            return rejected
+        
+        if not isinstance(urls, list):
+            return jsonify({'error': 'urls must be a list'}), 400
+        
+        if playlist_url:
+            playlist_id = extract_playlist_id(playlist_url)
+            if not playlist_id:
+                return jsonify({'error': 'Invalid YouTube playlist URL'}), 400
+            
+            downloader = YouTubeDownloader()
+            entries = downloader.get_playlist_entries(
+                f'https://www.youtube.com/playlist?list={playlist_id}', limit=max_items)
+            urls = urls + [entry['url'] for entry in entries]
+        
+        if not urls:
+            return jsonify({'error': 'urls or playlist_url is required'}), 400
+        
+        if len(urls) > max_items:
+            return jsonify({'error': f'At most {max_items} URLs per batch'}), 400
+        
+        invalid = [url for url in urls if not isinstance(url, str) or not validate_youtube_url(url)]
+        if invalid:
+            return jsonify({'error': 'Invalid YouTube URL(s) in batch', 'invalid_urls': invalid}), 400
+        
+        rejected = queue_full_response(len(urls))
+        if rejected:
+            return rejected
+        
+        # Each URL costs as much as a single download request would
+        if rate_limiter.enabled:
+            wait = rate_limiter.consume('batch_items', rate_limiter.client_id(), len(urls))
+            if wait:
+                return too_many_requests('Rate limit exceeded for batch items', wait)
+        
+        batch = DownloadBatch(source_url=playlist_url, format_type=format_type, quality=quality)
+        items = submit_downloads(urls, format_type, quality, batch=batch)
+        batch_id = batch.id
+        
+        return jsonify({
+            'success': True,
+            'batch_id': batch_id,
+            'total': len(items),
+            'items': items,
+            'status_url': f'/api/batch/{batch_id}/status'
+        })
+        
+    except Exception as e:
+        logger.error(f"API batch error: {str(e)}")
+        return jsonify({'error': f'Batch submission failed: {str(e)}'}), 500
+
+@app.route('/api/batch/<int:batch_id>/status')
+def batch_status(batch_id):
+    """Aggregate status of a batch; add ?items=1 for per-download status"""
+    # Outside the try so an unknown batch is a 404, not a 500
+    batch = DownloadBatch.query.get_or_404(batch_id)
+    try:
+        download_ids = json.loads(batch.download_ids)
+        
+        # Per item, like total: repeated URLs share a download but count once each
+        statuses = dict(db.session.query(DownloadHistory.id, DownloadHistory.status).filter(
+            DownloadHistory.id.in_(set(download_ids))))
+        counts = {'pending': 0, 'completed': 0, 'failed': 0}
+        for download_id in download_ids:
+            if download_id in statuses:
+                counts[statuses[download_id]] = counts.get(statuses[download_id], 0) + 1
+        
+        if counts['pending']:
+            overall = 'pending'
+        elif not counts['failed']:
+            overall = 'completed'
+        elif not counts['completed']:
+            overall = 'failed'
+        else:
+            overall = 'partial'
+        
+        response = {
+            'batch_id': batch.id,
+            'source_url': batch.source_url,
+            'format_type': batch.format_type,
+            'quality': batch.quality,
+            'total': len(download_ids),
+            'status': overall,
+            'counts': counts,
+            'created_at': batch.created_at.isoformat() if batch.created_at else None
+        }
+        
+        if request.args.get('items') == '1':
+            records = DownloadHistory.query.filter(DownloadHistory.id.in_(set(download_ids))).all()
+            by_id = {record.id: record for record in records}
+            response['items'] = [by_id[download_id].to_dict() for download_id in download_ids if download_id in by_id]
+        
+        return jsonify(response)
+    except Exception as e:
+        logger.error(f"Batch status error: {str(e)}")
+        return jsonify({'error': 'Batch status check failed'}), 500
+
 @app.route('/api/download/<int:download_id>/file')
 def download_file(download_id):
     """Serve downloaded file"""
@@ -119,30 +604,13 @@ def download_file(download_id):
             
         file_path = download_record.file_path
         
-        # If the exact path doesn't exist, try to find the file in downloads directory
-        if not os.path.exists(file_path):
-            # Try to find files with similar names in downloads directory
-            downloads_dir = 'downloads'
-            if os.path.exists(downloads_dir):
-                files = os.listdir(downloads_dir)
-                # Look for files with the same title (excluding extension and quality)
-                title_part = download_record.title.replace('|', '_').replace('/', '_').replace('\\', '_')
-                for file in files:
-                    if title_part in file or file.replace('_', ' ') in download_record.title:
-                        file_path = os.path.join(downloads_dir, file)
-                        # Update the database with correct path
-                        download_record.file_path = file_path
-                        db.session.commit()
-                        break
-                        
+        # The recorded path is authoritative; a missing file was evicted or removed
         if not os.path.exists(file_path):
+            download_record.file_path = None
+            db.session.commit()
             return jsonify({'error': 'File not found'}), 404
             
-        return send_file(
-            file_path,
-            as_attachment=True,
-            download_name=os.path.basename(file_path)
-        )
+        return serve_download_file(file_path)
         
     except Exception as e:
         logger.error(f"File download error: {str(e)}")
@@ -153,12 +621,154 @@ def download_status(download_id):
     """Get download status"""
     try:
         download_record = DownloadHistory.query.get_or_404(download_id)
-        return jsonify(download_record.to_dict())
+        status = download_record.to_dict()
+        status['queue'] = {
+            **executor.stats(),
+            'position': executor.position(download_id)
+        }
+        status['progress'] = progress_bus.latest(download_id)
+        return jsonify(status)
     except Exception as e:
         logger.error(f"Status check error: {str(e)}")
         return jsonify({'error': 'Status check failed'}), 500
 
+def progress_snapshot(download_record):
+    """Latest progress event for a download, falling back to its stored status"""
+    if download_record.status in TERMINAL_STAGES:
+        return {
+            'download_id': download_record.id,
+            'stage': download_record.status,
+            'title': download_record.title,
+            'error_message': download_record.error_message,
+            'download_url': f'/api/download/{download_record.id}/file' if download_record.status == 'completed' else None
+        }
+    return progress_bus.latest(download_record.id) or {
+        'download_id': download_record.id,
+        'stage': 'queued',
+        'queue_position': executor.position(download_record.id)
+    }
+
+def progress_event_stream(snapshots):
+    """Server-Sent Events stream of progress for the given downloads"""
+    # Every open stream holds a request thread; past the cap clients poll the status endpoint
+    if not progress_bus.open_stream():
+        response = jsonify({'error': 'Too many progress streams open, poll the status endpoint instead',
+                            'retry_after': 10})
+        response.status_code = 503
+        response.headers['Retry-After'] = '10'
+        return response
+    
+    max_seconds = int(os.environ.get('SSE_MAX_STREAM_SECONDS', 300))
+    subscribed = [event['download_id'] for event in snapshots if event['stage'] not in TERMINAL_STAGES]
+    subscriber = progress_bus.subscribe(subscribed)
+    
+    # A job may have finished between reading the snapshot and subscribing
+    for i, event in enumerate(snapshots):
+        latest = progress_bus.latest(event['download_id'])
+        if event['stage'] not in TERMINAL_STAGES and latest and latest['stage'] in TERMINAL_STAGES:
+            snapshots[i] = latest
+    pending = {event['download_id'] for event in snapshots if event['stage'] not in TERMINAL_STAGES}
+    
+    def format_event(event):
+        return f"event: progress\ndata: {json.dumps(event)}\n\n"
+    
+    def generate():
+        try:
+            yield "retry: 3000\n\n"
+            for event in snapshots:
+                yield format_event(event)
+            
+            deadline = time.monotonic() + max_seconds
+            while pending and time.monotonic() < deadline:
+                try:
+                    event = subscriber.get(timeout=5)
+                except queue.Empty:
+                    # Jobs run by another process only report completion through the DB
+                    finished = [progress_snapshot(record) for record in DownloadHistory.query.filter(
+                        DownloadHistory.id.in_(pending), DownloadHistory.status.in_(TERMINAL_STAGES)).all()]
+                    db.session.commit()
+                    for event in finished:
+                        pending.discard(event['download_id'])
+                        yield format_event(event)
+                    if not finished:
+                        yield ": keepalive\n\n"
+                    continue
+                yield format_event(event)
+                if event['stage'] in TERMINAL_STAGES:
+                    pending.discard(event['download_id'])
+            
+            if not pending:
+                yield "event: done\ndata: {}\n\n"
+        finally:
+            progress_bus.unsubscribe(subscribed, subscriber)
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Runs even if the client disconnects before the generator starts
+    response.call_on_close(progress_bus.close_stream)
+    return response
+
+@app.route('/api/download/<int:download_id>/events')
+def download_events(download_id):
+    """Stream progress for one download as Server-Sent Events"""
+    download_record = DownloadHistory.query.get_or_404(download_id)
+    return progress_event_stream([progress_snapshot(download_record)])
+
+@app.route('/api/downloads/events')
+def downloads_events():
+    """Stream progress for several downloads (?ids=1,2,3) over one connection"""
+    try:
+        download_ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip()]
+    except ValueError:
+        return jsonify({'error': 'Invalid ids parameter'}), 400
+    
+    if not download_ids:
+        return jsonify({'error': 'ids parameter is required'}), 400
+    if len(download_ids) > 100:
+        return jsonify({'error': 'At most 100 ids per stream'}), 400
+    
+    records = DownloadHistory.query.filter(DownloadHistory.id.in_(download_ids)).all()
+    if not records:
+        return jsonify({'error': 'Not found'}), 404
+    
+    return progress_event_stream([progress_snapshot(record) for record in records])
+
+def info_lookup_cost():
+    # Cache hits and polls for a running lookup never reach YouTube
+    url = (request.get_json(silent=True) or {}).get('url') if request.method == 'POST' else request.args.get('url')
+    return 0 if url and info_service.is_known(url) else 1
+
+def info_lookup_response(url, wait=None):
+    """Video info once it is ready; 202 with Retry-After while the lookup is still running"""
+    if wait is not None:
+        try:
+            wait = float(wait)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'wait must be a number of seconds'}), 400
+    
+    try:
+        info = info_service.lookup(url, app, wait)
+    except InfoServiceBusy as e:
+        response = jsonify({'error': f'Too many metadata lookups in progress: {str(e)}', 'retry_after': 5})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+    
+    if info is None:
+        response = jsonify({'success': False, 'status': 'pending', 'retry_after': 1})
+        response.status_code = 202
+        response.headers['Retry-After'] = '1'
+        return response
+    
+    return jsonify({
+        'success': True,
+        'info': info
+    })
+
 @app.route('/api/info', methods=['POST'])
+@rate_limiter.limit('info', cost=info_lookup_cost)
 def get_video_info():
     """Get video information without downloading"""
     try:
@@ -171,25 +781,64 @@ def get_video_info():
         if not validate_youtube_url(url):
             return jsonify({'error': 'Invalid YouTube URL'}), 400
             
-        downloader = YouTubeDownloader()
-        info = downloader.get_video_info(url)
-        
-        return jsonify({
-            'success': True,
-            'info': info
-        })
+        return info_lookup_response(url, data.get('wait'))
         
     except Exception as e:
         logger.error(f"Video info error: {str(e)}")
         return jsonify({'error': f'Failed to get video info: {str(e)}'}), 500
 
+def encode_history_cursor(record):
+    return base64.urlsafe_b64encode(f"{record.created_at.isoformat()}|{record.id}".encode()).decode()
+
+def decode_history_cursor(cursor):
+    created_at, record_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(created_at), int(record_id)
+
+def parse_history_date(value):
+    """Accept YYYY-MM-DD or a full ISO timestamp"""
+    return datetime.fromisoformat(value) if value else None
+
 @app.route('/api/history')
 def download_history():
-    """Get download history"""
+    """Get download history, newest first, with cursor pagination and filters"""
     try:
-        downloads = DownloadHistory.query.order_by(DownloadHistory.created_at.desc()).limit(50).all()
+        try:
+            limit = min(max(int(request.args.get('limit', 50)), 1), 200)
+            cursor = request.args.get('cursor')
+            cursor = decode_history_cursor(cursor) if cursor else None
+            since = parse_history_date(request.args.get('since'))
+            until = parse_history_date(request.args.get('until'))
+        except ValueError:
+            return jsonify({'error': 'Invalid limit, cursor or date parameter'}), 400
+        
+        query = DownloadHistory.query.options(
+            load_only(*[getattr(DownloadHistory, name) for name in DownloadHistory.SUMMARY_COLUMNS]))
+        
+        for field in ('status', 'format_type', 'video_id'):
+            value = request.args.get(field)
+            if value:
+                query = query.filter(getattr(DownloadHistory, field) == value)
+        if since:
+            query = query.filter(DownloadHistory.created_at >= since)
+        if until:
+            query = query.filter(DownloadHistory.created_at < until)
+        
+        # Keyset pagination: continue strictly after the last (created_at, id) seen
+        if cursor:
+            cursor_created_at, cursor_id = cursor
+            query = query.filter(or_(
+                DownloadHistory.created_at < cursor_created_at,
+                and_(DownloadHistory.created_at == cursor_created_at, DownloadHistory.id < cursor_id)
+            ))
+        
+        records = query.order_by(DownloadHistory.created_at.desc(), DownloadHistory.id.desc()).limit(limit + 1).all()
+        has_more = len(records) > limit
+        records = records[:limit]
+        
         return jsonify({
-            'downloads': [download.to_dict() for download in downloads]
+            'downloads': [record.to_summary_dict() for record in records],
+            'has_more': has_more,
+            'next_cursor': encode_history_cursor(records[-1]) if has_more else None
         })
     except Exception as e:
         logger.error(f"History error: {str(e)}")
@@ -207,11 +856,18 @@ def upload_cookies():
             return jsonify({'error': 'No file selected'}), 400
         
         if file and file.filename.endswith('.txt'):
-            # Save the uploaded cookies file
-            file.save('cookies.txt')
+            # Each file is one identity in the pool; uploading the same name again replaces it
+            filename = secure_filename(file.filename)
+            try:
+                cookie_pool.add(file, filename)
+            except Exception as e:
+                logger.warning(f"Rejected cookies upload {filename}: {str(e)}")
+                return jsonify({'error': 'Not a valid Netscape cookies.txt file'}), 400
             return jsonify({
                 'success': True,
-                'message': 'Cookies file uploaded successfully. YouTube downloads should now work better.'
+                'message': 'Cookies file uploaded successfully. YouTube downloads should now work better.',
+                'jar': filename,
+                'jars': cookie_pool.stats()['jars']
             })
         else:
             return jsonify({'error': 'Please upload a .txt file'}), 400
@@ -224,14 +880,13 @@ def upload_cookies():
 def cookies_info():
     """Get information about cookies setup"""
     try:
-        cookies_exists = os.path.exists('cookies.txt')
-        cookies_size = 0
-        if cookies_exists:
-            cookies_size = os.path.getsize('cookies.txt')
+        cookie_pool.refresh()
+        pool = cookie_pool.stats()
         
         return jsonify({
-            'cookies_file_exists': cookies_exists,
-            'cookies_file_size': cookies_size,
+            'cookies_file_exists': pool['jars'] > 0,
+            'cookies_file_size': pool['total_bytes'],
+            'pool': pool,
             'instructions': {
                 'step1': 'Install browser extension "Get cookies.txt LOCALLY" or similar',
                 'step2': 'Visit youtube.com and log in to your account',
@@ -245,6 +900,7 @@ def cookies_info():
         return jsonify({'error': 'Failed to get cookies info'}), 500
 
 @app.route('/api/get/info')
+@rate_limiter.limit('info', cost=info_lookup_cost)
 def get_video_info_get():
     """Get video information using GET method"""
     try:
@@ -256,19 +912,44 @@ def get_video_info_get():
         if not validate_youtube_url(url):
             return jsonify({'error': 'Invalid YouTube URL'}), 400
             
+        return info_lookup_response(url, request.args.get('wait'))
+        
+    except Exception as e:
+        logger.error(f"Video info error: {str(e)}")
+        return jsonify({'error': f'Failed to get video info: {str(e)}'}), 500
+
+@app.route('/api/formats')
+@rate_limiter.limit('info')
+def get_video_formats():
+    """Available formats and the planned choice per quality"""
+    try:
+        url = request.args.get('url')
+        format_type = request.args.get('format')
+        quality = request.args.get('quality')
+        
+        if not url:
+            return jsonify({'error': 'URL parameter is required'}), 400
+            
+        if not validate_youtube_url(url):
+            return jsonify({'error': 'Invalid YouTube URL'}), 400
+            
+        if format_type and format_type not in ['video', 'audio']:
+            return jsonify({'error': 'Invalid format type. Use "video" or "audio"'}), 400
+            
         downloader = YouTubeDownloader()
-        info = downloader.get_video_info(url)
+        formats = downloader.get_formats(url, format_type, quality)
         
         return jsonify({
             'success': True,
-            'info': info
+            **formats
         })
         
     except Exception as e:
-        logger.error(f"Video info error: {str(e)}")
-        return jsonify({'error': f'Failed to get video info: {str(e)}'}), 500
+        logger.error(f"Video formats error: {str(e)}")
+        return jsonify({'error': f'Failed to get video formats: {str(e)}'}), 500
 
 @app.route('/api/get/download')
+@rate_limiter.limit('download')
 def api_download_get():
     """Download video/audio using GET method"""
     try:
@@ -290,63 +971,160 @@ def api_download_get():
         if format_type not in ['video', 'audio']:
             return jsonify({'error': 'Invalid format type. Use "video" or "audio"'}), 400
             
-        # Valid quality options
-        video_qualities = ['3gp', '360p', '480p', '720p', '1080p']
-        audio_qualities = ['128kbps', '192kbps', '256kbps', '320kbps']
+        rejected = invalid_quality_response(format_type, quality)
+        if rejected:
+            return rejected
+            
+        rejected = queue_full_response()
+        if rejected:
+            return rejected
+            
+        # Attach to an identical in-flight or finished download when possible
+        download_record, deduplicated = submit_download(url, format_type, quality)
         
-        if format_type == 'video' and quality not in video_qualities:
-            return jsonify({'error': f'Invalid video quality. Use: {", ".join(video_qualities)}'}), 400
-        elif format_type == 'audio' and quality not in audio_qualities:
-            return jsonify({'error': f'Invalid audio quality. Use: {", ".join(audio_qualities)}'}), 400
+        # Wait for the shared job; returns at once for a reused finished file. The
+        # wait is bounded so queued jobs can't pin every request thread.
+        if not executor.wait(download_record.id, timeout=DOWNLOAD_WAIT_SECONDS):
+            response = jsonify({
+                'success': False,
+                'download_id': download_record.id,
+                'status': 'pending',
+                'deduplicated': deduplicated,
+                'queue_position': executor.position(download_record.id),
+                'status_url': f'/api/download/{download_record.id}/status',
+                'retry_after': 10
+            })
+            response.status_code = 202
+            response.headers['Retry-After'] = '10'
+            return response
+        db.session.refresh(download_record)
+        
+        if download_record.status != 'completed':
+            logger.error(f"Download failed for URL {url}: {download_record.error_message}")
+            return jsonify({'error': f'Download failed: {download_record.error_message}'}), 500
+        
+        return jsonify({
+            'success': True,
+            'download_id': download_record.id,
+            'title': download_record.title,
+            'file_path': download_record.file_path,
+            'deduplicated': deduplicated,
+            'download_url': f'/api/download/{download_record.id}/file',
+            'direct_download': f'/api/get/file?id={download_record.id}'
+        })
             
-        # Create download history record
+    except Exception as e:
+        logger.error(f"API download error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+def tee_stream_to_disk(chunks, url, video_id, format_type, quality, title, ext, processing=None):
+    """Yield stream chunks while saving them, then record the file for later reuse"""
+    # A directory of its own, apart from any queued job for the same video and quality
+    output_dir = job_output_dir(video_id, quality, job_key=f"stream-{uuid.uuid4().hex[:8]}")
+    final_path = os.path.join(output_dir, f"{sanitize_filename(title)}_{quality}.{ext}")
+    part_path = f"{final_path}.part"
+    completed = False
+    
+    try:
+        with open(part_path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        
+        os.replace(part_path, final_path)
+        completed = True
+        
         download_record = DownloadHistory(
             url=url,
+            video_id=video_id,
+            title=title,
             format_type=format_type,
             quality=quality,
-            status='pending'
+            status='completed',
+            file_path=final_path,
+            processing=processing,
+            completed_at=datetime.utcnow()
         )
         db.session.add(download_record)
         db.session.commit()
+        storage_manager.register(final_path)
+        logger.info(f"Saved streamed download {download_record.id} to {final_path}")
+    finally:
+        # Client went away or the source failed: drop the partial file
+        if not completed and os.path.exists(part_path):
+            os.remove(part_path)
+
+@app.route('/api/get/stream')
+@rate_limiter.limit('download')
+def api_stream_get():
+    """Stream video/audio to the client while it is still being fetched"""
+    started = time.monotonic()
+    try:
+        url = request.args.get('url')
+        format_type = request.args.get('format', 'video')  # 'video' or 'audio'
+        quality = request.args.get('quality')
+        save = request.args.get('save', '1') != '0'
         
-        # Initialize downloader
-        downloader = YouTubeDownloader()
+        # Set default quality based on format
+        if not quality:
+            quality = '720p' if format_type == 'video' else '256kbps'
         
-        try:
-            # Download the content
-            if format_type == 'video':
-                result = downloader.download_video(url, quality)
-            else:
-                result = downloader.download_audio(url, quality)
+        # Validate inputs
+        if not url:
+            return jsonify({'error': 'URL parameter is required'}), 400
             
-            # Update download record
-            download_record.title = result.get('title', 'Unknown')
-            download_record.file_path = result.get('file_path')
-            download_record.status = 'completed'
-            download_record.completed_at = datetime.utcnow()
-            db.session.commit()
+        if not validate_youtube_url(url):
+            return jsonify({'error': 'Invalid YouTube URL'}), 400
             
-            return jsonify({
-                'success': True,
-                'download_id': download_record.id,
-                'title': result.get('title'),
-                'file_path': result.get('file_path'),
-                'download_url': f'/api/download/{download_record.id}/file',
-                'direct_download': f'/api/get/file?id={download_record.id}'
-            })
+        if format_type not in ['video', 'audio']:
+            return jsonify({'error': 'Invalid format type. Use "video" or "audio"'}), 400
             
+        rejected = invalid_quality_response(format_type, quality)
+        if rejected:
+            return rejected
+        
+        # Serve straight from disk when an identical download already finished
+        video_id = extract_video_id(url)
+        existing = find_existing_download(video_id, format_type, quality)
+        if existing and existing.status == 'completed':
+            return serve_download_file(existing.file_path)
+        
+        downloader = YouTubeDownloader()
+        try:
+            stream = downloader.open_stream(url, format_type, quality)
         except Exception as e:
-            # Update download record with error
-            download_record.status = 'failed'
-            download_record.error_message = str(e)
-            download_record.completed_at = datetime.utcnow()
-            db.session.commit()
-            
-            logger.error(f"Download failed for URL {url}: {str(e)}")
-            return jsonify({'error': f'Download failed: {str(e)}'}), 500
-            
+            logger.error(f"Stream setup failed for URL {url}: {str(e)}")
+            return jsonify({'error': f'Stream failed: {str(e)}'}), 500
+        
+        # Saved under the quality actually streamed, so a lower-resolution stream
+        # is never reused for a request that asked for more
+        served_quality = stream['quality']
+        chunks = stream['chunks']
+        if save and served_quality:
+            chunks = tee_stream_to_disk(chunks, url, video_id or stream['video_id'], format_type, served_quality,
+                                        stream['title'], stream['ext'], stream.get('processing'))
+        
+        download_name = f"{sanitize_filename(stream['title'])}_{served_quality or quality}.{stream['ext']}"
+        headers = {
+            'Content-Disposition': f"attachment; filename*=UTF-8''{quote(download_name)}",
+            'X-Accel-Buffering': 'no'
+        }
+        if stream.get('processing'):
+            headers['X-Audio-Processing'] = stream['processing']
+        if stream['filesize']:
+            headers['Content-Length'] = str(stream['filesize'])
+        
+        sent = {'bytes': 0}
+        def counted(chunks):
+            for chunk in chunks:
+                sent['bytes'] += len(chunk)
+                yield chunk
+        
+        response = Response(stream_with_context(counted(chunks)), mimetype=stream['mimetype'], headers=headers)
+        return metered_response(response, started, lambda: sent['bytes'])
+        
     except Exception as e:
-        logger.error(f"API download error: {str(e)}")
+        logger.error(f"API stream error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/get/file')
@@ -372,11 +1150,7 @@ def download_file_get():
         if not os.path.exists(file_path):
             return jsonify({'error': 'File not found'}), 404
             
-        return send_file(
-            file_path,
-            as_attachment=True,
-            download_name=os.path.basename(file_path)
-        )
+        return serve_download_file(file_path)
         
     except Exception as e:
         logger.error(f"File download error: {str(e)}")
@@ -386,20 +1160,7 @@ def download_file_get():
 def cleanup_files():
     """Clean up old downloaded files"""
     try:
-        downloads_dir = 'downloads'
-        if os.path.exists(downloads_dir):
-            for filename in os.listdir(downloads_dir):
-                if filename != '.gitkeep':
-                    file_path = os.path.join(downloads_dir, filename)
-                    try:
-                        os.remove(file_path)
-                        logger.info(f"Removed file: {file_path}")
-                    except Exception as e:
-                        logger.error(f"Failed to remove {file_path}: {str(e)}")
-        
-        # Update database records
-        DownloadHistory.query.update({DownloadHistory.file_path: None})
-        db.session.commit()
+        storage_manager.evict_all()
         
         flash('Files cleaned up successfully', 'success')
         return redirect(url_for('index'))
@@ -0,0 +1,83 @@
+"""Startup steps and timings
+
+Imported first by app.py, so STARTED approximates when the process began
+loading the app. Schema setup can run inline at import (the default) or,
+with SCHEMA_SETUP_ON_BOOT=0, in the background after the first request so
+a fresh worker answers /health immediately. WARMUP=1 additionally preloads
+yt-dlp, cookie jars and a database connection once the worker is serving.
+"""
+import os
+import time
+import shutil
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+STARTED = time.monotonic()
+
+schema_ready = threading.Event()
+timings = {}
+_deferred_started = False
+_lock = threading.Lock()
+
+def record(phase, seconds):
+    timings[phase] = round(seconds, 3)
+    logger.info(f"Startup: {phase} took {seconds:.3f}s")
+
+def init_database(app):
+    """Create missing tables and apply upgrade_schema(); safe to run repeatedly"""
+    from app import db
+    import models
+    started = time.monotonic()
+    with app.app_context():
+        db.create_all()
+        models.upgrade_schema()
+    record('schema_seconds', time.monotonic() - started)
+    schema_ready.set()
+
+def warm_up(app):
+    """Pay first-use costs before a user request does"""
+    started = time.monotonic()
+    import yt_dlp
+    from sqlalchemy import text
+    from app import db
+    from cookie_pool import cookie_pool
+    # The YouTube extractor is what every request resolves through
+    yt_dlp.YoutubeDL({'quiet': True}).get_info_extractor('Youtube')
+    cookie_pool.refresh(force=True)
+    with app.app_context():
+        db.session.execute(text('SELECT 1'))
+        db.session.remove()
+    if not shutil.which('ffmpeg'):
+        logger.warning("ffmpeg not found on PATH; audio conversion will fail")
+    record('warmup_seconds', time.monotonic() - started)
+
+def run_deferred(app, start_workers):
+    """Once per process: schema setup (if still needed), start_workers(), then the optional warm-up"""
+    global _deferred_started
+    with _lock:
+        if _deferred_started:
+            return
+        _deferred_started = True
+    record('first_request_seconds', time.monotonic() - STARTED)
+
+    def run():
+        while not schema_ready.is_set():
+            try:
+                init_database(app)
+            except Exception as e:
+                logger.error(f"Schema setup failed, retrying in 5s: {str(e)}")
+                time.sleep(5)
+        start_workers()
+        record('ready_seconds', time.monotonic() - STARTED)
+        if os.environ.get('WARMUP', '').lower() in ('1', 'true', 'yes'):
+            try:
+                warm_up(app)
+            except Exception as e:
+                logger.warning(f"Warm-up failed: {str(e)}")
+
+    threading.Thread(target=run, name='startup', daemon=True).start()
+
+def stats():
+    return {'schema_ready': schema_ready.is_set(), **timings}
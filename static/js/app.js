@@ -73,7 +73,9 @@ class YouTubeDownloader {
                 { value: '128kbps', text: '128 kbps' },
                 { value: '192kbps', text: '192 kbps' },
                 { value: '256kbps', text: '256 kbps (Recommended)' },
-                { value: '320kbps', text: '320 kbps (High Quality)' }
+                { value: '320kbps', text: '320 kbps (High Quality)' },
+                { value: 'm4a', text: 'M4A (Original, fastest)' },
+                { value: 'opus', text: 'Opus (Original, fastest)' }
             ];
             
             audioQualities.forEach(quality => {
@@ -103,15 +105,22 @@ class YouTubeDownloader {
         this.infoBtn.innerHTML = '<i class="fas fa-spinner fa-spin"></i>';
 
         try {
-            const response = await fetch('/api/info', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({ url: url })
-            });
-
-            const data = await response.json();
+            let response;
+            let data;
+            // 202 means the lookup is still running server-side; poll until it finishes
+            do {
+                if (data && data.status === 'pending') {
+                    await new Promise(resolve => setTimeout(resolve, (data.retry_after || 2) * 1000));
+                }
+                response = await fetch('/api/info', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                    },
+                    body: JSON.stringify({ url: url })
+                });
+                data = await response.json();
+            } while (response.status === 202);
 
             if (data.success) {
                 this.showVideoInfo(data.info);
@@ -195,10 +204,14 @@ class YouTubeDownloader {
 
             if (data.success) {
                 this.currentDownloadId = data.download_id;
-                this.updateProgress(50, 'Downloading...');
+                this.updateProgress(10, 'Queued...');
                 
-                // Poll for completion
-                this.pollDownloadStatus(data.download_id);
+                // Stream progress, falling back to polling without EventSource
+                if (window.EventSource) {
+                    this.streamDownloadProgress(data.download_id);
+                } else {
+                    this.pollDownloadStatus(data.download_id);
+                }
             } else {
                 this.showError(data.error || 'Download failed');
             }
@@ -209,6 +222,47 @@ class YouTubeDownloader {
         }
     }
 
+    streamDownloadProgress(downloadId) {
+        const source = new EventSource(`/api/download/${downloadId}/events`);
+        let finished = false;
+
+        source.addEventListener('progress', async (e) => {
+            const event = JSON.parse(e.data);
+
+            if (event.stage === 'completed') {
+                finished = true;
+                source.close();
+                this.updateProgress(100, 'Download completed!');
+                const response = await fetch(`/api/download/${downloadId}/status`);
+                const data = await response.json();
+                setTimeout(() => {
+                    this.showSuccess(data);
+                }, 1000);
+            } else if (event.stage === 'failed') {
+                finished = true;
+                source.close();
+                this.showError(event.error_message || 'Download failed');
+            } else if (event.stage === 'downloading' && event.percent !== null) {
+                const speed = event.speed ? ` at ${this.formatFileSize(event.speed)}/s` : '';
+                this.updateProgress(10 + event.percent * 0.8, `Downloading... ${event.percent.toFixed(1)}%${speed}`);
+            } else if (event.stage === 'postprocessing') {
+                this.updateProgress(95, 'Processing...');
+            } else if (event.stage === 'resolving') {
+                this.updateProgress(10, 'Resolving video...');
+            } else if (event.stage === 'queued' && event.queue_position) {
+                this.updateProgress(5, `Queued (position ${event.queue_position})...`);
+            }
+        });
+
+        source.onerror = () => {
+            // Stream dropped (e.g. proxy timeout): fall back to polling
+            if (!finished) {
+                source.close();
+                this.pollDownloadStatus(downloadId);
+            }
+        };
+    }
+
     async pollDownloadStatus(downloadId) {
         const maxAttempts = 60; // 5 minutes max
         let attempts = 0;
@@ -0,0 +1,225 @@
+import os
+import re
+import time
+import shutil
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from app import db
+from models import CachedFile, DownloadHistory
+
+logger = logging.getLogger(__name__)
+
+# Files a download or transcode is still producing: partial downloads and
+# fragments, yt-dlp's .ytdl state, per-format streams awaiting a merge
+# (name.f137.mp4) and audio sources awaiting a transcode (name.source.webm)
+IN_PROGRESS_FILE = re.compile(r'(\.part(-Frag\d+)?|\.ytdl|\.temp|\.f\d+\.\w+|\.source\.\w+)$')
+
+class StorageManager:
+    """Keeps the downloads directory within a byte budget by evicting cold files
+
+    Every finished file is registered in the CachedFile table with its size;
+    serving a file updates its access time and count. A background sweep
+    evicts least recently (or least frequently) used files when the total
+    exceeds max_bytes or free disk space drops below min_free_bytes, and
+    clears DownloadHistory.file_path for every record pointing at them.
+    """
+
+    def __init__(self, downloads_dir='downloads', max_bytes=2 * 1024 ** 3, min_free_bytes=512 * 1024 ** 2,
+                 policy='lru', sweep_interval=60, grace_seconds=300):
+        self.downloads_dir = downloads_dir
+        self.max_bytes = int(max_bytes)
+        self.min_free_bytes = int(min_free_bytes)
+        self.policy = policy if policy in ('lru', 'lfu') else 'lru'
+        self.sweep_interval = float(sweep_interval)
+        self.grace_seconds = int(grace_seconds)  # recently used files are never evicted
+        self._app = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self, app):
+        """Start the background sweep once per process"""
+        with self._lock:
+            if self._thread:
+                return
+            self._app = app
+            self._thread = threading.Thread(target=self._sweep_loop, name="storage-sweeper")
+            self._thread.daemon = True
+            self._thread.start()
+        logger.info(f"Storage manager started (budget {self.max_bytes} bytes, policy {self.policy})")
+
+    def register(self, path):
+        """Record a newly written file"""
+        if not path or not os.path.exists(path):
+            return
+        path = os.path.normpath(path)
+        now = datetime.utcnow()
+        try:
+            db.session.merge(CachedFile(
+                path=path,
+                size_bytes=os.path.getsize(path),
+                access_count=0,
+                created_at=now,
+                last_accessed_at=now
+            ))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"Failed to register stored file {path}: {str(e)}")
+
+    def touch(self, path):
+        """Record an access to a stored file"""
+        try:
+            CachedFile.query.filter(CachedFile.path == os.path.normpath(path)).update({
+                CachedFile.last_accessed_at: datetime.utcnow(),
+                CachedFile.access_count: CachedFile.access_count + 1
+            }, synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"Failed to record access to {path}: {str(e)}")
+
+    def usage(self):
+        total_bytes, file_count = db.session.query(
+            func.coalesce(func.sum(CachedFile.size_bytes), 0), func.count(CachedFile.path)).one()
+        disk = shutil.disk_usage(self.downloads_dir)
+        return {
+            'files': file_count,
+            'total_bytes': int(total_bytes),
+            'max_bytes': self.max_bytes,
+            'free_disk_bytes': disk.free,
+            'min_free_bytes': self.min_free_bytes,
+            'policy': self.policy
+        }
+
+    def enforce(self):
+        """Evict cold files until the byte budget and free-space watermark are met"""
+        usage = self.usage()
+        to_free = max(usage['total_bytes'] - self.max_bytes, self.min_free_bytes - usage['free_disk_bytes'])
+        if to_free <= 0:
+            return 0
+
+        if self.policy == 'lfu':
+            order = (CachedFile.access_count.asc(), CachedFile.last_accessed_at.asc())
+        else:
+            order = (CachedFile.last_accessed_at.asc(),)
+        grace_cutoff = datetime.utcnow() - timedelta(seconds=self.grace_seconds)
+        victims = CachedFile.query.filter(CachedFile.last_accessed_at < grace_cutoff).order_by(*order).limit(500).all()
+
+        freed = 0
+        evicted = 0
+        for victim in victims:
+            if freed >= to_free:
+                break
+            freed += victim.size_bytes
+            self._evict(victim.path)
+            evicted += 1
+        db.session.commit()
+
+        if evicted:
+            logger.info(f"Evicted {evicted} file(s), freed {freed} bytes ({self.policy})")
+        return evicted
+
+    def evict_all(self):
+        """Remove every stored file (manual cleanup)"""
+        for entry in os.listdir(self.downloads_dir):
+            path = os.path.join(self.downloads_dir, entry)
+            if entry == '.gitkeep':
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+                logger.info(f"Removed directory: {path}")
+            else:
+                self._remove_file(path)
+        CachedFile.query.delete()
+        DownloadHistory.query.update({DownloadHistory.file_path: None})
+        db.session.commit()
+
+    def reconcile(self, stale_part_seconds=3600):
+        """Sync the table with the directory: adopt unknown files, drop missing ones
+
+        Files still being written (see IN_PROGRESS_FILE) are never adopted, so
+        they don't count towards the budget or get evicted; once they are
+        older than stale_part_seconds they are leftovers and removed.
+        """
+        known = {row.path for row in db.session.query(CachedFile.path)}
+        on_disk = set()
+        now = time.time()
+
+        for root, dirs, files in os.walk(self.downloads_dir):
+            for filename in files:
+                if filename == '.gitkeep':
+                    continue
+                path = os.path.normpath(os.path.join(root, filename))
+                if IN_PROGRESS_FILE.search(filename):
+                    # Leftovers from aborted streams/downloads/transcodes
+                    if now - os.path.getmtime(path) > stale_part_seconds:
+                        self._remove_file(path)
+                    continue
+                on_disk.add(path)
+                if path not in known:
+                    accessed = datetime.utcfromtimestamp(os.path.getmtime(path))
+                    db.session.add(CachedFile(path=path, size_bytes=os.path.getsize(path),
+                                              access_count=0, created_at=accessed, last_accessed_at=accessed))
+
+        # Per-run directories left empty by failed or cleaned-up runs
+        for root, dirs, files in os.walk(self.downloads_dir, topdown=False):
+            try:
+                if os.path.samefile(root, self.downloads_dir) or os.listdir(root):
+                    continue
+                if now - os.path.getmtime(root) > stale_part_seconds:
+                    os.rmdir(root)
+            except OSError as e:
+                # A run may have just created or filled it
+                logger.error(f"Failed to remove directory {root}: {str(e)}")
+
+        for path in known - on_disk:
+            if not os.path.exists(path):
+                CachedFile.query.filter(CachedFile.path == path).delete(synchronize_session=False)
+                DownloadHistory.query.filter(DownloadHistory.file_path.in_([path, os.path.join('.', path)])).update(
+                    {DownloadHistory.file_path: None}, synchronize_session=False)
+        db.session.commit()
+
+    def _evict(self, path):
+        # Caller commits
+        self._remove_file(path)
+        normalized = os.path.normpath(path)
+        CachedFile.query.filter(CachedFile.path == normalized).delete(synchronize_session=False)
+        DownloadHistory.query.filter(DownloadHistory.file_path.in_({path, normalized})).update(
+            {DownloadHistory.file_path: None}, synchronize_session=False)
+
+    def _remove_file(self, path):
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+                logger.info(f"Removed file: {path}")
+            # Drop per-job directories left empty
+            parent = os.path.dirname(os.path.abspath(path))
+            root = os.path.abspath(self.downloads_dir)
+            while parent != root and parent.startswith(root) and not os.listdir(parent):
+                os.rmdir(parent)
+                parent = os.path.dirname(parent)
+        except Exception as e:
+            logger.error(f"Failed to remove {path}: {str(e)}")
+
+    def _sweep_loop(self):
+        sweeps = 0
+        while True:
+            try:
+                with self._app.app_context():
+                    if sweeps % 10 == 0:
+                        self.reconcile()
+                    self.enforce()
+            except Exception as e:
+                logger.error(f"Storage sweep failed: {str(e)}")
+            sweeps += 1
+            time.sleep(self.sweep_interval)
+
+storage_manager = StorageManager(
+    max_bytes=os.environ.get('STORAGE_MAX_BYTES', 2 * 1024 ** 3),
+    min_free_bytes=os.environ.get('STORAGE_MIN_FREE_BYTES', 512 * 1024 ** 2),
+    policy=os.environ.get('STORAGE_EVICTION_POLICY', 'lru').lower(),
+    sweep_interval=os.environ.get('STORAGE_SWEEP_INTERVAL', 60),
+    grace_seconds=os.environ.get('STORAGE_GRACE_SECONDS', 300)
+)
@@ -0,0 +1,153 @@
+import os
+import time
+import shutil
+import logging
+import threading
+import subprocess
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from metrics import stage_seconds
+
+logger = logging.getLogger(__name__)
+
+class TranscodeScheduler:
+    """CPU-bound ffmpeg stage, separate from the network-bound download workers
+
+    At most max_workers ffmpeg processes run at once (default: one per core),
+    each limited to threads_per_job threads and started at a lower priority
+    (niceness) so request handling stays responsive. Up to max_queue further
+    jobs may wait; beyond that submit() blocks, which applies backpressure
+    to the download workers feeding it. Live encodes for streamed responses
+    (pipe()) get the same priority and thread limits, and at most max_workers
+    of them run at once.
+    """
+
+    def __init__(self, max_workers=None, max_queue=32, threads_per_job=1, niceness=10):
+        self.max_workers = max(1, int(max_workers or os.cpu_count() or 1))
+        self.max_queue = int(max_queue)
+        self.threads_per_job = int(threads_per_job)
+        self.niceness = int(niceness)
+        self._nice = shutil.which('nice') if self.niceness else None
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='transcode')
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_queue)
+        self._pipe_slots = threading.BoundedSemaphore(self.max_workers)
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._running = 0
+        self._piped = 0
+
+    def submit(self, cmd, callback=None):
+        """Queue an ffmpeg command; callback(error) runs on the pool when it finishes"""
+        self._slots.acquire()
+        with self._lock:
+            self._submitted += 1
+        return self._pool.submit(self._run, cmd, callback)
+
+    def run(self, cmd):
+        """Run an ffmpeg command through the scheduler and wait for it"""
+        error = self.submit(cmd).result()
+        if error:
+            raise error
+
+    @contextmanager
+    def pipe(self, cmd):
+        """Start an ffmpeg command with stdin/stdout pipes, waiting for a free live-encode slot"""
+        self._pipe_slots.acquire()
+        with self._lock:
+            self._piped += 1
+        process = None
+        try:
+            process = subprocess.Popen(self._prioritized(cmd), stdin=subprocess.PIPE,
+                                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            yield process
+        finally:
+            if process and process.poll() is None:
+                process.kill()
+                process.wait()
+            with self._lock:
+                self._piped -= 1
+            self._pipe_slots.release()
+
+    def audio_cmd(self, source_path, output_path, bitrate, codec='libmp3lame'):
+        return [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+            '-threads', str(self.threads_per_job),
+            '-i', source_path,
+            '-vn', '-acodec', codec, '-b:a', f'{bitrate}k',
+            output_path
+        ]
+
+    @staticmethod
+    def remux_cmd(source_path, output_path):
+        """Stream-copy the audio track into output_path's container (no encoding)"""
+        return [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+            '-i', source_path,
+            '-vn', '-acodec', 'copy',
+            output_path
+        ]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'running': self._running,
+                'queued': self._submitted - self._running,
+                'max_queue': self.max_queue,
+                'piped': self._piped,
+                'threads_per_job': self.threads_per_job,
+                'niceness': self.niceness
+            }
+
+    def _prioritized(self, cmd):
+        # Through nice(1) rather than preexec_fn, which can deadlock the child of a threaded process
+        if self._nice:
+            return [self._nice, '-n', str(self.niceness), *cmd]
+        return cmd
+
+    def _run(self, cmd, callback):
+        with self._lock:
+            self._running += 1
+        error = None
+        started = time.monotonic()
+        try:
+            result = subprocess.run(self._prioritized(cmd), capture_output=True, text=True)
+            if result.returncode != 0:
+                error = Exception(f"FFmpeg conversion failed: {result.stderr}")
+        except Exception as e:
+            error = e
+        finally:
+            stage_seconds.observe(time.monotonic() - started, stage='transcode')
+            with self._lock:
+                self._running -= 1
+                self._submitted -= 1
+            self._slots.release()
+
+        if error:
+            logger.error(f"Transcode failed: {str(error)}")
+        if callback:
+            try:
+                callback(error)
+            except Exception as e:
+                logger.error(f"Transcode callback failed: {str(e)}")
+        return error
+
+def probe_audio_codec(path):
+    """Codec name of the first audio stream in a local file, '' if unknown"""
+    try:
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', '-select_streams', 'a:0',
+             '-show_entries', 'stream=codec_name', '-of', 'default=noprint_wrappers=1:nokey=1', path],
+            capture_output=True, text=True, timeout=30
+        )
+    except Exception as e:
+        logger.warning(f"ffprobe failed for {path}: {str(e)}")
+        return ''
+    return result.stdout.strip() if result.returncode == 0 else ''
+
+transcoder = TranscodeScheduler(
+    max_workers=os.environ.get('TRANSCODE_WORKERS') or None,
+    max_queue=os.environ.get('TRANSCODE_MAX_QUEUE', 32),
+    threads_per_job=os.environ.get('TRANSCODE_THREADS_PER_JOB', 1),
+    niceness=os.environ.get('TRANSCODE_NICENESS', 10)
+)
@@ -0,0 +1,99 @@
+import os
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+MB = 1048576
+
+class ThroughputTuner:
+    """Picks fragment concurrency and HTTP chunk size from measured throughput
+
+    Every finished transfer records its per-connection rate and the aggregate
+    rate it implies for the whole process (rate x transfers running at the
+    time). A new transfer gets its fair share of the best recent aggregate,
+    split over as many connections as it takes to fill that share, and
+    chunks sized to take about chunk_seconds each. An idle process therefore
+    opens up to the full pipe, a busy one backs off.
+    """
+
+    def __init__(self, min_fragments=1, max_fragments=8, min_chunk=MB, max_chunk=10 * MB,
+                 chunk_seconds=2.0, window=20, default_fragments=2, default_chunk=5 * MB):
+        self.min_fragments = int(min_fragments)
+        self.max_fragments = int(max_fragments)
+        self.min_chunk = int(min_chunk)
+        self.max_chunk = int(max_chunk)
+        self.chunk_seconds = float(chunk_seconds)
+        self.default_fragments = int(default_fragments)
+        self.default_chunk = int(default_chunk)
+        self._samples = deque(maxlen=int(window))  # (per-connection B/s, aggregate B/s)
+        self._active = 0
+        self._last_options = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def transfer(self):
+        """Count a running transfer towards the current load"""
+        with self._lock:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def record(self, downloaded_bytes, elapsed, connections=1):
+        """Record a finished transfer; tiny or instant ones say nothing about the link"""
+        if not downloaded_bytes or not elapsed or elapsed < 0.5 or downloaded_bytes < 256 * 1024:
+            return
+        rate = downloaded_bytes / elapsed
+        with self._lock:
+            self._samples.append((rate / max(1, connections), rate * max(1, self._active)))
+
+    def options(self, expected_bytes=None):
+        """yt-dlp options for a transfer that is about to start"""
+        with self._lock:
+            samples = list(self._samples)
+            active = self._active
+
+        if samples:
+            per_connection = sorted(s[0] for s in samples)[len(samples) // 2]
+            capacity = max(s[1] for s in samples)
+            share = capacity / (active + 1)
+            fragments = round(share / per_connection) if per_connection else self.default_fragments
+            chunk = per_connection * self.chunk_seconds
+        else:
+            fragments, chunk = self.default_fragments, self.default_chunk
+
+        if expected_bytes:
+            # Small files gain nothing from more connections or chunks than they can fill
+            chunk = min(chunk, expected_bytes)
+            fragments = min(fragments, max(1, expected_bytes // self.min_chunk))
+
+        fragments = int(min(self.max_fragments, max(self.min_fragments, fragments)))
+        chunk = int(min(self.max_chunk, max(self.min_chunk, chunk)))
+        chunk -= chunk % (256 * 1024)
+
+        options = {'concurrent_fragment_downloads': fragments, 'http_chunk_size': chunk}
+        with self._lock:
+            self._last_options = options
+        return options
+
+    def stats(self):
+        with self._lock:
+            samples = list(self._samples)
+            return {
+                'samples': len(samples),
+                'active_transfers': self._active,
+                'per_connection_bps': int(sorted(s[0] for s in samples)[len(samples) // 2]) if samples else None,
+                'capacity_bps': int(max(s[1] for s in samples)) if samples else None,
+                'last_options': self._last_options
+            }
+
+throughput_tuner = ThroughputTuner(
+    max_fragments=os.environ.get('DOWNLOAD_MAX_FRAGMENTS', 8),
+    min_chunk=os.environ.get('DOWNLOAD_MIN_CHUNK_BYTES', MB),
+    max_chunk=os.environ.get('DOWNLOAD_MAX_CHUNK_BYTES', 10 * MB)
+)
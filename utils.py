@@ -1,5 +1,6 @@
 import re
 import os
+import uuid
 import logging
 from urllib.parse import urlparse, parse_qs
 
@@ -49,6 +50,23 @@ def extract_video_id(url):
     
     return None
 
+def is_youtube_playlist_url(url):
+    """Check if URL points to a YouTube playlist"""
+    return extract_playlist_id(url) is not None
+
+def extract_playlist_id(url):
+    """Extract playlist ID from a YouTube playlist URL"""
+    if not url:
+        return None
+    
+    parsed = urlparse(url if '://' in url else f'https://{url}')
+    
+    if parsed.hostname in ['www.youtube.com', 'youtube.com', 'm.youtube.com', 'music.youtube.com']:
+        if parsed.path in ['/playlist', '/watch']:
+            return parse_qs(parsed.query).get('list', [None])[0]
+    
+    return None
+
 def sanitize_filename(filename):
     """Sanitize filename for safe file system storage"""
     if not filename:
@@ -73,6 +91,20 @@ def sanitize_filename(filename):
     
     return filename
 
+def job_output_dir(video_id, quality, downloads_dir='downloads', job_key=None):
+    """Private output directory for one download run: downloads/<video_id>/<quality>/<job_key>
+    
+    Runs for the same video and quality (duplicate jobs, a re-claimed job
+    whose first run is still going, stream saves) never share a directory,
+    so they can't overwrite each other's partial or final files. Without a
+    job_key a random one is used.
+    """
+    job_key = job_key or uuid.uuid4().hex[:12]
+    path = os.path.join(downloads_dir, sanitize_filename(video_id or 'unknown'), sanitize_filename(quality),
+                        sanitize_filename(job_key))
+    os.makedirs(path, exist_ok=True)
+    return path
+
 def format_duration(seconds):
     """Format duration in seconds to human readable format"""
     if not seconds:
@@ -151,6 +183,7 @@ def is_youtube_shorts_url(url):
 def get_video_format_info(info_dict):
     """Extract available format information from yt-dlp info dict"""
     formats = []
+    duration = info_dict.get('duration')
     
     if 'formats' in info_dict:
         for f in info_dict['formats']:
@@ -164,8 +197,22 @@ def get_video_format_info(info_dict):
                 'vcodec': f.get('vcodec'),
                 'acodec': f.get('acodec'),
                 'filesize': f.get('filesize'),
-                'format_note': f.get('format_note')
+                'format_note': f.get('format_note'),
+                'protocol': f.get('protocol'),
+                'tbr': f.get('tbr'),
+                'abr': f.get('abr'),
+                'expected_bytes': estimate_format_bytes(f, duration)
             }
             formats.append(format_info)
     
     return formats
+
+def estimate_format_bytes(f, duration):
+    """Exact, approximate or bitrate-derived size of a format in bytes; None if unknown"""
+    size = f.get('filesize') or f.get('filesize_approx')
+    if size:
+        return int(size)
+    bitrate = f.get('tbr') or ((f.get('vbr') or 0) + (f.get('abr') or 0))
+    if bitrate and duration:
+        return int(bitrate * 1000 / 8 * duration)
+    return None
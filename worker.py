@@ -0,0 +1,15 @@
+"""Standalone download worker: python worker.py
+
+Claims jobs from the shared DownloadHistory queue, so downloads can run in
+dedicated processes (set DOWNLOAD_WORKERS_IN_WEB=0 on the web service).
+"""
+from app import app  # imports routes, which registers the job handler
+from jobs import executor
+from storage import storage_manager
+import startup
+
+if __name__ == '__main__':
+    if not startup.schema_ready.is_set():
+        startup.init_database(app)
+    storage_manager.start(app)
+    executor.run_forever()